@@ -0,0 +1,127 @@
+import logging
+import os
+import queue
+import re
+import threading
+import time
+
+from Tracing import tracer
+
+log = logging.getLogger(__name__)
+
+
+class CheckpointWriter():
+    """
+    Writes checkpoints (models, training examples) to disk, by default on a
+    background thread so the training loop does not block on I/O.
+
+    Callers submit an in-memory snapshot together with the function that
+    writes it. Every file is written to a temporary file first and then
+    renamed, so a crash never leaves a truncated checkpoint behind. After
+    every write, only the keep_last most recent checkpoint_N.pth.tar files
+    (and, separately, checkpoint_N.pth.tar.examples files) are kept.
+    """
+
+    CHECKPOINT = re.compile(r'^checkpoint_(\d+)\.pth\.tar(\.examples)?$')
+
+    def __init__(self, background=True, keep_last=None):
+        self.background = background
+        self.keep_last = keep_last
+        self.latencies = []  # (filepath, seconds) of the writes completed since popLatencies
+        self.lock = threading.Lock()
+        self.error = None
+        self.queue = queue.Queue()
+        self.thread = None
+        if background:
+            self.thread = threading.Thread(target=self._run, name='CheckpointWriter', daemon=True)
+            self.thread.start()
+
+    def submit(self, filepath, write_fn, snapshot):
+        """
+        Writes snapshot to filepath by calling write_fn(snapshot, path). The
+        snapshot must not be modified afterwards.
+        """
+        self._raiseError()
+        if self.background:
+            self.queue.put((filepath, write_fn, snapshot))
+        else:
+            self._write(filepath, write_fn, snapshot)
+
+    def wait(self):
+        """
+        Blocks until all submitted checkpoints are written.
+        """
+        if self.background:
+            self.queue.join()
+        self._raiseError()
+
+    def close(self):
+        """
+        Writes the remaining checkpoints and stops the background thread.
+        Checkpoints submitted afterwards are written synchronously.
+        """
+        if self.background and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.background = False
+        self._raiseError()
+
+    def popLatencies(self):
+        """
+        Returns:
+            (filepath, seconds) of every write completed since the last call
+        """
+        with self.lock:
+            latencies, self.latencies = self.latencies, []
+        return latencies
+
+    def _raiseError(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+            except Exception as e:
+                log.error(f'Writing checkpoint {item[0]} failed: {e}')
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _write(self, filepath, write_fn, snapshot):
+        start = time.time()
+        folder = os.path.dirname(filepath)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder, exist_ok=True)
+        tmp = filepath + '.tmp'
+        with tracer.span('write_checkpoint', 'io', file=os.path.basename(filepath)):
+            try:
+                write_fn(snapshot, tmp)
+                os.replace(tmp, filepath)
+            except BaseException:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+                raise
+        latency = time.time() - start
+        with self.lock:
+            self.latencies.append((filepath, latency))
+        log.info(f'Wrote {filepath} in {latency:.2f}s')
+        self._applyRetention(folder)
+
+    def _applyRetention(self, folder):
+        if not self.keep_last:
+            return
+        checkpoints = {}
+        for filename in os.listdir(folder or '.'):
+            match = self.CHECKPOINT.match(filename)
+            if match:
+                checkpoints.setdefault(match.group(2), []).append((int(match.group(1)), filename))
+        for files in checkpoints.values():
+            for _, filename in sorted(files)[:-self.keep_last]:
+                os.remove(os.path.join(folder, filename))
+                log.debug(f'Removed old checkpoint {filename}')
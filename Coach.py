@@ -1,15 +1,26 @@
 import logging
 import os
 import sys
+import time
+import zipfile
 from collections import deque
+from contextlib import contextmanager
 from pickle import Pickler, Unpickler
-from random import shuffle
 
 import numpy as np
 from tqdm import tqdm
 
 from Arena import PlanningArena
+from CheckpointWriter import CheckpointWriter
 from MCTS import MCTS
+from Profiling import PhaseProfiler
+from Metrics import MetricsSink
+from qzero_planning.InferenceNNet import InferenceNNet
+from RankedReward import SlidingPercentile
+from Reanalyse import Reanalyser
+from ReplayBuffer import ExampleArrays, MemmapReplayBuffer, ReplayBuffer
+from Tracing import tracer
+from utils import get_rng_state, set_rng_state
 
 log = logging.getLogger(__name__)
 
@@ -25,9 +36,27 @@ class Coach():
         self.nnet = nnet
         self.pnet = self.nnet.__class__(self.game)  # the competitor network
         self.args = args
+        # small network distilled from nnet, used instead of it in self-play
+        self.student = self.nnet.__class__(self.game, **self.args.studentArgs) if self.args.studentArgs else None
         self.mcts = MCTS(self.nnet, self.args)
-        self.trainExamplesHistory = []  # history of examples from args.numItersForTrainExamplesHistory latest iterations
-        self.skipFirstSelfPlay = False  # can be overriden in loadTrainExamples()
+        # history of examples from args.numItersForTrainExamplesHistory latest iterations
+        self.replayBuffer = self.makeReplayBuffer()
+        # ranked-reward threshold, updated as episodes finish
+        self.rankedReward = SlidingPercentile(self.args.rankedRewardPercentile, self.args.rankedRewardWindow)
+        # refreshes old policy targets with the current network while self-play runs
+        self.reanalyser = Reanalyser(self.game, self.nnet, self.replayBuffer, self.args)
+        self.skipFirstSelfPlay = False  # can be overriden in loadTrainExamples() or loadRunState()
+        self.startIter = 1  # can be overriden in loadRunState()
+        # checkpoint files holding the current model and student (with their optimizers), once saved
+        self.modelFile = None
+        self.studentFile = None
+        self.checkpointWriter = CheckpointWriter(background=self.args.asyncCheckpoints,
+                                                 keep_last=self.args.keepCheckpoints)
+        self.metrics = MetricsSink(
+            jsonl_file=self.args.metricsFile and os.path.join(self.args.checkpoint, self.args.metricsFile),
+            prometheus_file=self.args.prometheusFile)
+        self.profiler = PhaseProfiler(self.args.checkpoint, iterations=self.args.profileIters,
+                                      phases=self.args.profilePhases)
 
     # def executeEpisode(self):
     #     """
@@ -121,75 +150,225 @@ class Coach():
         only if it wins >= updateThreshold fraction of games.
         """
 
-        for i in range(1, self.args.numIters + 1):
+        for i in range(self.startIter, self.args.numIters + 1):
             # bookkeeping
             log.info(f'Starting Iter #{i} ...')
+            self.metrics.startIteration(i)
+            self.profiler.startIteration(i)
+            if i in self.args.traceIters:
+                tracer.start()
             # examples of the iteration
-            if not self.skipFirstSelfPlay or i > 1:
-                iterationTrainExamples = deque([], maxlen=self.args.maxlenOfQueue)
-
-                for _ in tqdm(range(self.args.numEps), desc="Self Play"):
-                    self.mcts = MCTS(self.nnet, self.args)  # reset search tree
-                    iterationTrainExamples += self.executeEpisode()
+            if not self.skipFirstSelfPlay or i > self.startIter:
+                with self.phase('selfplay'):
+                    iterationTrainExamples = deque([], maxlen=self.args.maxlenOfQueue)
+                    self.rankedReward.startIteration(i)
+                    if self.args.reanalyseFraction:
+                        self.reanalyser.start()
+                    selfPlayNNet = self.getSelfPlayNNet()
+
+                    for _ in tqdm(range(self.args.numEps), desc="Self Play"):
+                        self.mcts = MCTS(selfPlayNNet, self.args)  # reset search tree
+                        with tracer.span('episode', 'selfplay'):
+                            episodeExamples = self.executeEpisode()
+                        self.rankedReward.update(episodeExamples[-1][2], weight=len(episodeExamples))
+                        iterationTrainExamples += episodeExamples
+                        self.metrics.add('episodes', 1)
+                        self.metrics.add('positions', len(episodeExamples))
+                        self.metrics.add('nn_evals', self.mcts.numPredictions)
+
+                if self.args.reanalyseFraction:
+                    with self.phase('reanalyse'):
+                        self.metrics.add('reanalysed', self.reanalyser.join())
 
                 # save the iteration examples to the history 
-                self.trainExamplesHistory.append(iterationTrainExamples)
+                self.replayBuffer.add(iterationTrainExamples, i)
 
-            if len(self.trainExamplesHistory) > self.args.numItersForTrainExamplesHistory:
+            if self.replayBuffer.numIterations() > self.args.numItersForTrainExamplesHistory:
                 log.warning(
-                    f"Removing the oldest entry in trainExamples. len(trainExamplesHistory) = {len(self.trainExamplesHistory)}")
-                self.trainExamplesHistory.pop(0)
+                    f"Removing the oldest entry in trainExamples. numIterations = {self.replayBuffer.numIterations()}")
+                self.replayBuffer.evict(self.args.numItersForTrainExamplesHistory)
             # backup history to a file
             # NB! the examples were collected using the model from the previous iteration, so (i-1)  
-            self.saveTrainExamples(i - 1)
+            with self.phase('checkpoint'):
+                self.saveTrainExamples(i - 1)
+                self.saveRunState(i, selfPlayDone=True)
 
-            trainExamples, perc = self.prepareTrainExamples()
+            with self.phase('prepare'):
+                trainExamples, perc = self.prepareTrainExamples()
 
-            # training new network, keeping a copy of the old one
-            self.nnet.save_checkpoint(folder=self.args.checkpoint, filename='temp.pth.tar')
-            self.pnet.load_checkpoint(folder=self.args.checkpoint, filename='temp.pth.tar')
+            # training new network, keeping a copy of the old one (in memory, no checkpoint needed)
+            self.pnet.clone_from(self.nnet)
+            # and of the optimizer state, which a rejected training run must not carry over either
+            snapshot = self.nnet.snapshot()
             pmcts = MCTS(self.pnet, self.args)
 
-            self.nnet.train(trainExamples)
+            with self.phase('train'):
+                steps = self.nnet.train(trainExamples, num_new_examples=len(self.replayBuffer.lastIterationRows()))
+                self.metrics.add('train_steps', steps or 0)
             nmcts = MCTS(self.nnet, self.args)
 
             log.info('PITTING AGAINST PREVIOUS VERSION')
             # arena = PlanningArena(lambda x: np.argmax(pmcts.getActionProb(x, verbose=True, temp=0)),
             #                         lambda x: np.argmax(nmcts.getActionProb(x, verbose=True, temp=0)), self.game, perc)
-            arena = PlanningArena(lambda game, board: np.argmax(pmcts.getActionProb(game, board, verbose=False, temp=0)),
-                                    lambda game, board: np.argmax(nmcts.getActionProb(game, board, verbose=False, temp=0)), self.game, perc)
-            prewards, nrewards = arena.playGames(self.args.arenaCompare)
+            with self.phase('arena'):
+                arena = PlanningArena(lambda game, board: np.argmax(pmcts.getActionProb(game, board, verbose=False, temp=0)),
+                                        lambda game, board: np.argmax(nmcts.getActionProb(game, board, verbose=False, temp=0)), self.game, perc)
+                prewards, nrewards = arena.playGames(self.args.arenaCompare)
 
             log.info('NEW/PREV REWARDS : %d / %d' % (nrewards, prewards))
-            if nrewards == prewards or float(nrewards) / (prewards + nrewards) < self.args.updateThreshold:
-                log.info('REJECTING NEW MODEL')
-                self.nnet.load_checkpoint(folder=self.args.checkpoint, filename='temp.pth.tar')
-            else:
-                log.info('ACCEPTING NEW MODEL')
-                self.nnet.save_checkpoint(folder=self.args.checkpoint, filename=self.getCheckpointFile(i))
-                self.nnet.save_checkpoint(folder=self.args.checkpoint, filename='best.pth.tar')
+            with self.phase('checkpoint'):
+                if nrewards == prewards or float(nrewards) / (prewards + nrewards) < self.args.updateThreshold:
+                    log.info('REJECTING NEW MODEL')
+                    self.nnet.restore(snapshot)
+                else:
+                    log.info('ACCEPTING NEW MODEL')
+                    self.nnet.save_checkpoint(folder=self.args.checkpoint, filename=self.getCheckpointFile(i),
+                                              writer=self.checkpointWriter)
+                    self.nnet.save_checkpoint(folder=self.args.checkpoint, filename='best.pth.tar',
+                                              writer=self.checkpointWriter)
+                    self.modelFile = 'best.pth.tar'
+                    if self.args.exportModel:
+                        self.nnet.export(folder=self.args.checkpoint, filename=self.args.exportModel,
+                                         writer=self.checkpointWriter)
+
+            if self.student is not None:
+                with self.phase('distill'):
+                    self.student.distill_from(self.nnet, self.getDistillBoards(),
+                                              num_new_examples=len(self.replayBuffer.lastIterationRows()))
+
+            with self.phase('checkpoint'):
+                if self.student is not None:
+                    self.student.save_checkpoint(folder=self.args.checkpoint, filename='student.pth.tar',
+                                                 writer=self.checkpointWriter)
+                    self.studentFile = 'student.pth.tar'
+                self.saveRunState(i, selfPlayDone=False)
+
+            # time the checkpoint writer spent on disk, possibly in the background
+            self.metrics.add('checkpoint_write_time', sum(t for _, t in self.checkpointWriter.popLatencies()))
+            self.metrics.endIteration()
+            self.profiler.endIteration()
+            if tracer.enabled:
+                tracer.stop(os.path.join(self.args.checkpoint, f'trace_{i}.json'))
+
+        self.checkpointWriter.close()
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Marks a phase of the training loop (selfplay, prepare, train, arena,
+        checkpoint, ...) for the metrics, the profiler and the tracer.
+        """
+        with self.metrics.phase(name), self.profiler.phase(name), tracer.span(name, 'phase'):
+            yield
+
+    def getSelfPlayNNet(self):
+        """
+        Returns the network self-play MCTS runs on: the student if any, else
+        nnet. With args.selfPlayBackend, that network is exported to the
+        checkpoint folder and reloaded into an InferenceNNet running on the
+        TorchScript or ONNX backend.
+        """
+        nnet = self.nnet if self.student is None else self.student
+        if not self.args.selfPlayBackend:
+            return nnet
+        extensions = {'torchscript': '.pt', 'onnx': '.onnx'}
+        if self.args.selfPlayBackend not in extensions:
+            raise ValueError(f"Unknown self-play backend '{self.args.selfPlayBackend}', "
+                             f"expected one of {list(extensions)}")
+        filename = 'selfplay' + extensions[self.args.selfPlayBackend]
+        # exported synchronously: the file is loaded right away
+        nnet.export(folder=self.args.checkpoint, filename=filename)
+        return InferenceNNet(self.game, os.path.join(self.args.checkpoint, filename))
+
+    def getDistillBoards(self):
+        """
+        Returns the network inputs of at most args.distillBoards examples for
+        the student to be distilled on, drawn from the last iteration if it has
+        that many, else from the whole replay buffer. Only these boards are
+        read and evaluated by the teacher, not the whole window.
+        """
+        rows = self.replayBuffer.lastIterationRows()
+        if self.args.distillBoards is None or len(rows) < self.args.distillBoards:
+            rows = self.replayBuffer.indices()
+        if self.args.distillBoards is not None and len(rows) > self.args.distillBoards:
+            rows = np.random.choice(rows, self.args.distillBoards, replace=False)
+        return self.replayBuffer.inputs[np.sort(rows)]
 
     def prepareTrainExamples(self):
         # Ranked reward: we replace the actual reward with 0 or 1, depending on whether
         # that reward is smaller/larger than the 75 percentile of all rewards.
-        
-        # compute .75 percentile for the last iteration
-        iterationExamples = self.trainExamplesHistory[-1]
-        perc = np.percentile([e[2] for e in iterationExamples], 75)
-        log.info(f"Percentile is {perc}")
+        start = time.time()
 
-        trainExamples = []
-        for e in self.trainExamplesHistory:
-            trainExamples.extend(e)
+        # the percentile of the rewards of the last iteration(s) is tracked while playing
+        perc = self.rankedReward.percentile()
+        log.info(f"Percentile is {perc}")
 
         # compute the ranked reward for all training examples (not only the last iteration)
-        trainExamples = [(np.where(e[0] != 0, 1, 0), e[1], 1 if e[2]>perc else 0) for e in trainExamples]
-        
-        # shuffle examples before training
-        shuffle(trainExamples)
-
+        rows = self.relabelExamples(perc)
+
+        # shuffle the index rather than the examples; the boards were binarized when added
+        index = rows[np.random.permutation(len(rows))]
+        # MCTS predicts on the boards as played, e.g. to calibrate a quantized network on
+        trainExamples = ExampleArrays(self.replayBuffer.inputs, self.replayBuffer.pis, self.replayBuffer.values,
+                                      index=index, predict_boards=self.replayBuffer.boards)
+
+        if self.args.replayPriorities == 'rank':
+            # prioritize examples by the rank of their reward, best first: priority 1/rank;
+            # equal rewards (e.g. all examples of an episode) share the best rank among them
+            rewards = self.replayBuffer.rewards[index]
+            ranks = np.searchsorted(np.sort(-rewards), -rewards, side='left') + 1
+            self.replayBuffer.priorities[index] = 1. / ranks
+        if self.args.replayPriorities not in (None, 'rank', 'loss'):
+            raise ValueError(f"Unknown replayPriorities '{self.args.replayPriorities}', expected 'rank' or 'loss'")
+        if self.args.replayPriorities:
+            # sampled through the index; with 'loss' the network writes its losses back to the buffer
+            trainExamples.priorities = self.replayBuffer.priorities
+            trainExamples.priority_updates = 'loss' if self.args.replayPriorities == 'loss' else None
+
+        if self.args.dedupExamples:
+            # many episodes pass through the same partial schedules: merge their examples
+            # (the merged examples get their own priorities, which are not written back)
+            trainExamples = trainExamples.dedup(self.replayBuffer.boards[index])
+            log.info(f"Merged {len(rows)} training examples into {len(trainExamples)} unique states")
+
+        log.info(f"Prepared {len(trainExamples)} training examples in {time.time() - start:.3f}s")
         return trainExamples, perc
 
+    def relabelExamples(self, threshold):
+        """
+        Sets the value targets of all examples in the replay buffer to 1 if
+        their reward exceeds threshold, 0 otherwise. Returns their rows.
+        """
+        rows = self.replayBuffer.indices()
+        self.replayBuffer.values[rows] = self.replayBuffer.rewards[rows] > threshold
+        return rows
+
+    @staticmethod
+    def binarize(boards):
+        # the network only sees which cells of the schedule are occupied
+        return (boards != 0).astype(np.int8)
+
+    def makeReplayBuffer(self):
+        capacity = self.getReplayCapacity()
+        pi_dtype = np.dtype(self.args.replayPiDtype)
+        board_dtype = self.getBoardDtype()
+        if self.args.replayBackend == 'memmap':
+            folder = self.args.replayFolder or os.path.join(self.args.checkpoint, 'replay')
+            log.info(f"Using a memory-mapped replay buffer in {folder}")
+            return MemmapReplayBuffer(folder, capacity, self.game.getBoardSize(), self.game.getActionSize(),
+                                      pi_dtype=pi_dtype, input_fn=self.binarize, board_dtype=board_dtype)
+        return ReplayBuffer(capacity, self.game.getBoardSize(), self.game.getActionSize(), pi_dtype=pi_dtype,
+                            input_fn=self.binarize, board_dtype=board_dtype)
+
+    def getBoardDtype(self):
+        # the boards hold the urns of the placed domain actions (0 for empty cells)
+        return np.min_scalar_type(max([d.urn for d in self.game.domainactions], default=0))
+
+    def getReplayCapacity(self):
+        if self.args.replayCapacity:
+            return self.args.replayCapacity
+        return self.args.maxlenOfQueue * self.args.numItersForTrainExamplesHistory
+
     def getCheckpointFile(self, iteration):
         return 'checkpoint_' + str(iteration) + '.pth.tar'
 
@@ -198,9 +377,7 @@ class Coach():
         if not os.path.exists(folder):
             os.makedirs(folder)
         filename = os.path.join(folder, self.getCheckpointFile(iteration) + ".examples")
-        with open(filename, "wb+") as f:
-            Pickler(f).dump(self.trainExamplesHistory)
-        f.closed
+        self.replayBuffer.save(filename, writer=self.checkpointWriter)
 
     def loadTrainExamples(self):
         modelFile = os.path.join(self.args.load_folder_file[0], self.args.load_folder_file[1])
@@ -212,9 +389,96 @@ class Coach():
                 sys.exit()
         else:
             log.info("File with trainExamples found. Loading it...")
-            with open(examplesFile, "rb") as f:
-                self.trainExamplesHistory = Unpickler(f).load()
+            if zipfile.is_zipfile(examplesFile):
+                self.replayBuffer.load(examplesFile)
+            else:
+                # examples saved by older versions: a pickled list of deques, one per iteration
+                with open(examplesFile, "rb") as f:
+                    trainExamplesHistory = Unpickler(f).load()
+                for iteration, examples in enumerate(trainExamplesHistory, 1 - len(trainExamplesHistory)):
+                    self.replayBuffer.add(examples, iteration)
             log.info('Loading done!')
 
+            for iteration, rows in self.replayBuffer.iterationRows():
+                self.rankedReward.startIteration(iteration)
+                self.rankedReward.updateMany(self.replayBuffer.rewards[rows])
+
             # examples based on the model were already collected (loaded)
             self.skipFirstSelfPlay = True
+
+    def saveRunState(self, iteration, selfPlayDone):
+        """
+        Saves everything needed to resume the run non-interactively: the
+        iteration, the model (and optimizer) state, the student model if any,
+        the replay buffer (through the examples file saved for this
+        iteration), the ranked-reward estimator and the random number
+        generator states.
+
+        If selfPlayDone, the self-play phase of iteration has finished and a
+        resumed run continues with training in that same iteration; otherwise
+        the whole iteration has finished and a resumed run starts the next one.
+
+        Models already saved in the checkpoint folder (the best model and the
+        student, see modelFile and studentFile) are referenced by file name
+        rather than copied into the run state; only a model that was never
+        saved, e.g. before the first accepted network, is stored in it.
+        """
+        state = {
+            'iteration': iteration,
+            'selfPlayDone': selfPlayDone,
+            'modelFile': self.modelFile,
+            'model': self.nnet.snapshot() if self.modelFile is None else None,
+            'studentFile': self.studentFile,
+            'student': self.student.snapshot() if self.student is not None and self.studentFile is None else None,
+            'examplesFile': self.getCheckpointFile(iteration - 1) + ".examples",
+            'rankedReward': self.rankedReward.getState(),
+            'rng': get_rng_state(),
+        }
+        filepath = os.path.join(self.args.checkpoint, self.getRunStateFile())
+        self.checkpointWriter.submit(filepath, self.writeRunState, state)
+
+    @staticmethod
+    def writeRunState(state, filename):
+        with open(filename, "wb+") as f:
+            Pickler(f).dump(state)
+
+    def getRunStateFile(self):
+        return 'run_state.pkl'
+
+    def loadRunState(self):
+        """
+        Restores the state saved by saveRunState from the checkpoint folder.
+
+        Returns:
+            True if a run state was found and restored, False otherwise
+        """
+        filepath = os.path.join(self.args.checkpoint, self.getRunStateFile())
+        if not os.path.isfile(filepath):
+            log.warning(f'No run state found in "{filepath}", starting a new run')
+            return False
+        with open(filepath, "rb") as f:
+            state = Unpickler(f).load()
+
+        self.modelFile = state.get('modelFile')
+        if self.modelFile is not None:
+            self.nnet.load_checkpoint(self.args.checkpoint, self.modelFile)
+        else:
+            self.nnet.restore(state['model'])
+        if self.student is not None:
+            self.studentFile = state.get('studentFile')
+            if self.studentFile is not None:
+                self.student.load_checkpoint(self.args.checkpoint, self.studentFile)
+            elif state.get('student') is not None:
+                self.student.restore(state['student'])
+        self.replayBuffer.load(os.path.join(self.args.checkpoint, state['examplesFile']))
+        self.rankedReward.setState(state['rankedReward'])
+        set_rng_state(state['rng'])
+        if state['selfPlayDone']:
+            self.startIter = state['iteration']
+            self.skipFirstSelfPlay = True
+        else:
+            self.startIter = state['iteration'] + 1
+            self.skipFirstSelfPlay = False
+        log.info(f"Resuming run at iteration {self.startIter}"
+                 f"{' after self-play' if self.skipFirstSelfPlay else ''}")
+        return True
@@ -3,6 +3,8 @@ import math
 
 import numpy as np
 
+from Tracing import tracer
+
 EPS = 1e-8
 
 log = logging.getLogger(__name__)
@@ -25,6 +27,8 @@ class MCTS():
         self.Es = {}  # stores game.getGameEnded ended for board s
         self.Vs = {}  # stores game.getValidMoves for board s
 
+        self.numPredictions = 0  # number of neural network evaluations, for metrics
+
     def getActionProb(self, game, board, temp=1, verbose=False):
         """
         This function performs numMCTSSims simulations of MCTS starting from
@@ -36,8 +40,9 @@ class MCTS():
         """
         canonicalBoard = game.getCanonicalForm(board)
 
-        for _ in range(self.args.numMCTSSims):
-            self.search(game, canonicalBoard, verbose=verbose)
+        with tracer.span('mcts_simulations', 'mcts', sims=self.args.numMCTSSims):
+            for _ in range(self.args.numMCTSSims):
+                self.search(game, canonicalBoard, verbose=verbose)
 
         s = game.stringRepresentation(canonicalBoard)
         counts = [self.Nsa[(s, a)] if (s, a) in self.Nsa else 0 for a in range(game.getActionSize())]
@@ -93,6 +98,7 @@ class MCTS():
             if verbose:
                 log.info(f"Node is leaf node, using NN to predict value for\n{s}")
             self.Ps[s], v = self.nnet.predict(canonicalBoard)
+            self.numPredictions += 1
             valids = game.getValidMoves(canonicalBoard)
             self.Ps[s] = self.Ps[s] * valids  # masking invalid moves
             sum_Ps_s = np.sum(self.Ps[s])
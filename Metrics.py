@@ -0,0 +1,98 @@
+import json
+import logging
+import os
+import resource
+import time
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+
+class MetricsSink():
+    """
+    Collects performance metrics of every iteration of Coach.learn: the time
+    spent per phase (self-play, train, arena, checkpoint, ...), counters such
+    as episodes, positions, network evaluations and training steps, derived
+    rates, and the peak resident set size.
+
+    At the end of every iteration the metrics are appended as one JSON line to
+    jsonl_file and, if prometheus_file is given, written there in Prometheus
+    text format (e.g. for the node exporter's textfile collector).
+    """
+
+    PREFIX = 'alphazero_'
+
+    # rate name -> (counter, phase whose time it is divided by)
+    RATES = {
+        'episodes_per_sec': ('episodes', 'selfplay'),
+        'positions_per_sec': ('positions', 'selfplay'),
+        'nn_evals_per_sec': ('nn_evals', 'selfplay'),
+        'train_steps_per_sec': ('train_steps', 'train'),
+    }
+
+    def __init__(self, jsonl_file=None, prometheus_file=None):
+        self.jsonl_file = jsonl_file
+        self.prometheus_file = prometheus_file
+        self.current = None
+
+    def startIteration(self, iteration):
+        self.current = {'iteration': iteration, 'timestamp': time.time()}
+
+    @contextmanager
+    def phase(self, name):
+        """
+        Adds the time spent in the with-block to the metric <name>_time.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name + '_time', time.perf_counter() - start)
+
+    def add(self, name, value):
+        if self.current is not None:
+            self.current[name] = self.current.get(name, 0) + value
+
+    def endIteration(self):
+        """
+        Computes the derived metrics and writes the metrics of the iteration.
+
+        Returns:
+            the metrics of the iteration as a dict
+        """
+        metrics, self.current = self.current, None
+        for rate, (counter, phase) in self.RATES.items():
+            if metrics.get(counter) is not None and metrics.get(phase + '_time'):
+                metrics[rate] = metrics[counter] / metrics[phase + '_time']
+        # ru_maxrss is in kilobytes on Linux
+        metrics['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+        log.info('Iteration metrics: ' + ', '.join(f'{k}={v:.3g}' for k, v in metrics.items()
+                                                   if k not in ('iteration', 'timestamp')))
+        if self.jsonl_file:
+            self._makeFolder(self.jsonl_file)
+            with open(self.jsonl_file, 'a') as f:
+                f.write(json.dumps(metrics) + '\n')
+        if self.prometheus_file:
+            self._writePrometheus(metrics)
+        return metrics
+
+    def _writePrometheus(self, metrics):
+        self._makeFolder(self.prometheus_file)
+        lines = []
+        for name, value in metrics.items():
+            if name == 'timestamp':
+                continue
+            lines.append(f'# TYPE {self.PREFIX}{name} gauge')
+            lines.append(f'{self.PREFIX}{name} {value}')
+        # the textfile collector may read at any time: write a temporary file and rename it
+        tmp = self.prometheus_file + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp, self.prometheus_file)
+
+    @staticmethod
+    def _makeFolder(filename):
+        folder = os.path.dirname(filename)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
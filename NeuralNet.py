@@ -1,3 +1,11 @@
+import os
+import tempfile
+
+import numpy as np
+
+from ReplayBuffer import ExampleArrays
+
+
 class NeuralNet():
     """
     This class specifies the base NeuralNet class. To define your own neural
@@ -11,7 +19,7 @@ class NeuralNet():
     def __init__(self, game):
         pass
 
-    def train(self, examples):
+    def train(self, examples, num_new_examples=None):
         """
         This function trains the neural network with examples obtained from
         self-play.
@@ -21,6 +29,9 @@ class NeuralNet():
                       (board, pi, v). pi is the MCTS informed policy vector for
                       the given board, and v is its value. The examples has
                       board in its canonical form.
+            num_new_examples: how many of the examples are new since the previous
+                              call; implementations may use it to size the
+                              amount of training.
         """
         pass
 
@@ -36,6 +47,71 @@ class NeuralNet():
         """
         pass
 
+    def predict_batch(self, boards):
+        """
+        Input:
+            boards: a sequence (or numpy array) of boards in their canonical form.
+
+        Returns:
+            pis: the policy vectors of the boards, stacked into a numpy array
+                 of shape (len(boards), game.getActionSize())
+            vs: the values of the boards, a numpy array of length len(boards)
+
+        Implementations should evaluate all boards with one forward pass; this
+        default calls predict once per board.
+        """
+        pis, vs = zip(*[self.predict(board) for board in boards])
+        return np.stack(pis), np.asarray(vs, dtype=np.float64).reshape(len(boards))
+
+    def distill_from(self, teacher, boards, num_new_examples=None):
+        """
+        Trains this (typically smaller) network to reproduce the policies and
+        values that the teacher network predicts for boards. The targets are
+        passed to train as ExampleArrays, so train must accept those.
+
+        Returns:
+            whatever train returns
+        """
+        pis, vs = zip(*[teacher.predict_batch(boards[i:i + 1024]) for i in range(0, len(boards), 1024)])
+        return self.train(ExampleArrays(boards, np.concatenate(pis), np.concatenate(vs)), num_new_examples)
+
+    def snapshot(self):
+        """
+        Returns:
+            snapshot: an in-memory copy of the parameters of the neural network,
+                      unaffected by further training
+
+        This default goes through save_checkpoint in a temporary folder and
+        keeps the contents of the files written there; implementations should
+        override it with a direct copy of their parameters.
+        """
+        with tempfile.TemporaryDirectory() as folder:
+            self.save_checkpoint(folder, 'snapshot.pth.tar')
+            files = {}
+            for filename in os.listdir(folder):
+                with open(os.path.join(folder, filename), 'rb') as f:
+                    files[filename] = f.read()
+        if not files:
+            raise NotImplementedError(f'{self.__class__.__name__}.save_checkpoint wrote nothing to snapshot')
+        return {'files': files}
+
+    def restore(self, snapshot):
+        """
+        Sets the parameters of the neural network to those of a snapshot.
+        """
+        with tempfile.TemporaryDirectory() as folder:
+            for filename, data in snapshot['files'].items():
+                with open(os.path.join(folder, filename), 'wb') as f:
+                    f.write(data)
+            self.load_checkpoint(folder, 'snapshot.pth.tar')
+
+    def clone_from(self, other):
+        """
+        Copies the parameters of another neural network of the same class
+        into this one, without going through a checkpoint file.
+        """
+        self.restore(other.snapshot())
+
     def save_checkpoint(self, folder, filename):
         """
         Saves the current neural network (with its parameters) in
@@ -0,0 +1,92 @@
+import numpy as np
+
+
+class SumTree():
+    """
+    Binary tree over n non-negative priorities in which every node holds the
+    sum of its children, stored as a flat array (root at 1, leaves from
+    self.leaves on). Sampling an index proportional to its priority and
+    updating a priority both take O(log n); both are vectorized over batches.
+    """
+
+    def __init__(self, priorities):
+        self.size = len(priorities)
+        self.leaves = 1 << max(0, (self.size - 1).bit_length())
+        self.tree = np.zeros(2 * self.leaves, dtype=np.float64)
+        self.tree[self.leaves:self.leaves + self.size] = priorities
+        start = self.leaves
+        while start > 1:
+            parents = np.arange(start // 2, start)
+            self.tree[parents] = self.tree[2 * parents] + self.tree[2 * parents + 1]
+            start //= 2
+
+    def total(self):
+        return self.tree[1] if self.leaves > 1 else self.tree[self.leaves]
+
+    def get(self, ids):
+        return self.tree[self.leaves + ids]
+
+    def update(self, ids, priorities):
+        nodes = self.leaves + np.asarray(ids)
+        self.tree[nodes] = priorities
+        nodes = np.unique(nodes // 2)
+        while len(nodes) and nodes[0] >= 1:
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            nodes = np.unique(nodes // 2)
+            nodes = nodes[nodes >= 1]
+
+    def sample(self, batch_size):
+        """
+        Returns:
+            ids: batch_size indices drawn proportional to their priority, one
+                 from each of batch_size equal slices of the total (stratified)
+        """
+        draws = (np.arange(batch_size) + np.random.random(batch_size)) * (self.total() / batch_size)
+        nodes = np.ones(batch_size, dtype=np.int64)
+        while nodes[0] < self.leaves:
+            left = 2 * nodes
+            right = draws >= self.tree[left]
+            draws -= self.tree[left] * right
+            nodes = left + right
+        return np.minimum(nodes - self.leaves, self.size - 1)
+
+
+class PrioritizedSampler():
+    """
+    Prioritized sampling of training examples (Schaul et al., Prioritized
+    Experience Replay). Example i is drawn with probability proportional to
+    weight_i * priority_i ** alpha, and importance-sampling weights, annealed
+    by beta, correct the loss back towards sampling proportional to weight_i.
+
+    Input:
+        weights: the sampling weights the examples would have without
+                 prioritization (e.g. merged duplicate counts), or None
+        priorities: initial priorities, or None to start with equal ones
+    """
+
+    def __init__(self, num_examples, weights=None, priorities=None, alpha=0.6, beta=0.4, eps=1e-3):
+        self.weights = np.ones(num_examples) if weights is None else np.asarray(weights, dtype=np.float64)
+        self.alpha = alpha
+        self.beta = beta
+        self.eps = eps
+        if priorities is None:
+            priorities = np.ones(num_examples)
+        self.tree = SumTree(self.weights * np.power(np.asarray(priorities, dtype=np.float64) + eps, alpha))
+
+    def sample(self, batch_size):
+        """
+        Returns:
+            ids: the sampled example ids
+            is_weights: their importance-sampling weights, at most 1
+        """
+        ids = self.tree.sample(batch_size)
+        probs = self.tree.get(ids) / self.tree.total()
+        target = self.weights[ids] / self.weights.sum()
+        is_weights = np.power(target / np.maximum(probs, 1e-12), self.beta)
+        return ids, (is_weights / is_weights.max()).astype(np.float32)
+
+    def update(self, ids, priorities):
+        """
+        Sets new priorities (e.g. the last training loss) for the given ids.
+        """
+        self.tree.update(ids, self.weights[ids] * np.power(np.asarray(priorities, dtype=np.float64) + self.eps, self.alpha))
@@ -0,0 +1,69 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+
+class PhaseProfiler():
+    """
+    Opt-in cProfile profiling of the phases of Coach.learn (selfplay, prepare,
+    train, arena, ...) for selected iterations.
+
+    For every profiled iteration i, the profile of each phase is written to
+    folder/profile_<i>_<phase>.prof (readable with pstats or snakeviz), and
+    the top_n functions by cumulative time of every phase are summarized in
+    folder/profile_<i>.txt.
+
+    cProfile only sees the thread it runs on, so work done by background
+    threads (checkpoint writer, reanalyse) does not show up in the profiles.
+    """
+
+    def __init__(self, folder, iterations=(), phases=None, top_n=25):
+        self.folder = folder
+        self.iterations = set(iterations or ())
+        self.phases = set(phases) if phases else None
+        self.top_n = top_n
+        self.iteration = None
+        self.profiles = {}
+
+    def startIteration(self, iteration):
+        self.iteration = iteration
+        self.profiles = {}
+
+    def isActive(self, name):
+        return self.iteration in self.iterations and (self.phases is None or name in self.phases)
+
+    @contextmanager
+    def phase(self, name):
+        if not self.isActive(name):
+            yield
+            return
+        profile = self.profiles.setdefault(name, cProfile.Profile())
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+
+    def endIteration(self):
+        """
+        Writes the profiles and the summary of the iteration, if it was profiled.
+        """
+        if not self.profiles:
+            return
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        summary = io.StringIO()
+        for name, profile in self.profiles.items():
+            profile.dump_stats(os.path.join(self.folder, f'profile_{self.iteration}_{name}.prof'))
+            summary.write(f'===== {name} =====\n')
+            pstats.Stats(profile, stream=summary).sort_stats('cumulative').print_stats(self.top_n)
+        filename = os.path.join(self.folder, f'profile_{self.iteration}.txt')
+        with open(filename, 'w') as f:
+            f.write(summary.getvalue())
+        log.info(f'Wrote profiles of iteration {self.iteration} ({", ".join(self.profiles)}) to {self.folder}')
+        self.profiles = {}
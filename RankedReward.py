@@ -0,0 +1,104 @@
+import logging
+import threading
+from collections import deque
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+class SlidingPercentile():
+    """
+    Streaming estimate of a percentile of the rewards of the last window
+    iterations, used as the ranked-reward threshold.
+
+    Every iteration keeps a small sketch of (value, weight) centroids instead
+    of the rewards themselves. As long as an iteration has at most
+    max_centroids distinct rewards the sketch is exact and percentile() agrees
+    with np.percentile over the (weighted) rewards; beyond that, neighbouring
+    centroids are merged and the result is an approximation.
+
+    update() and percentile() may be called from different threads.
+    """
+
+    def __init__(self, percentile=75, window=1, max_centroids=256):
+        self.q = percentile
+        self.window = window
+        self.max_centroids = max_centroids
+        self.sketches = deque()  # [iteration, {value: weight}] per iteration, oldest first
+        self.lock = threading.Lock()
+
+    def startIteration(self, iteration):
+        """
+        Starts collecting the rewards of a new iteration, dropping iterations
+        that fall out of the window.
+        """
+        with self.lock:
+            self.sketches.append([iteration, {}])
+            while len(self.sketches) > self.window:
+                self.sketches.popleft()
+
+    def update(self, reward, weight=1):
+        """
+        Adds a reward of the current iteration, e.g. the reward of a finished
+        episode weighted by its number of training examples.
+        """
+        with self.lock:
+            if not self.sketches:
+                self.sketches.append([None, {}])
+            sketch = self.sketches[-1][1]
+            reward = float(reward)
+            sketch[reward] = sketch.get(reward, 0) + weight
+            if len(sketch) > 2 * self.max_centroids:
+                self.sketches[-1][1] = self._compress(sketch)
+
+    def updateMany(self, rewards):
+        """
+        Adds an array of rewards of the current iteration.
+        """
+        values, counts = np.unique(np.asarray(rewards, dtype=np.float64), return_counts=True)
+        for value, count in zip(values, counts):
+            self.update(value, int(count))
+
+    def getState(self):
+        with self.lock:
+            return [[iteration, dict(sketch)] for iteration, sketch in self.sketches]
+
+    def setState(self, state):
+        with self.lock:
+            self.sketches = deque([[iteration, dict(sketch)] for iteration, sketch in state])
+
+    def _compress(self, sketch):
+        values = np.array(sorted(sketch))
+        weights = np.array([sketch[v] for v in values], dtype=np.float64)
+        # merge neighbours into max_centroids groups of (roughly) equal weight
+        before = np.cumsum(weights) - weights
+        groups = np.floor(before / weights.sum() * self.max_centroids).astype(int)
+        merged = {}
+        for g in np.unique(groups):
+            members = groups == g
+            value = float(np.average(values[members], weights=weights[members]))
+            merged[value] = merged.get(value, 0) + float(weights[members].sum())
+        return merged
+
+    def percentile(self):
+        """
+        Returns:
+            the percentile of the rewards in the window, or None if no rewards
+            were seen yet
+        """
+        with self.lock:
+            centroids = {}
+            for _, sketch in self.sketches:
+                for value, weight in sketch.items():
+                    centroids[value] = centroids.get(value, 0) + weight
+        if not centroids:
+            return None
+
+        values = np.array(sorted(centroids))
+        cumulative = np.cumsum([centroids[v] for v in values])
+        # linear interpolation between the closest ranks, as np.percentile does
+        rank = self.q / 100. * (cumulative[-1] - 1)
+        lower = values[np.searchsorted(cumulative, np.floor(rank), side='right')]
+        upper = values[np.searchsorted(cumulative, np.ceil(rank), side='right')]
+        return lower + (upper - lower) * (rank - np.floor(rank))
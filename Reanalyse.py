@@ -0,0 +1,89 @@
+import logging
+import threading
+import time
+
+import numpy as np
+
+from MCTS import MCTS
+from utils import dotdict
+
+log = logging.getLogger(__name__)
+
+
+class Reanalyser():
+    """
+    Refreshes the policy targets of older examples in the replay buffer by
+    searching again from their boards with the current network (MuZero
+    Reanalyse). A fraction of the examples of all but the newest iteration is
+    sampled, and their pis are overwritten in place with the new MCTS policy.
+
+    It runs on a background thread, e.g. alongside self-play. The network
+    must not be trained and the replay buffer must not be added to until
+    join() returns.
+    """
+
+    def __init__(self, game, nnet, replayBuffer, args):
+        self.game = game
+        self.nnet = nnet
+        self.replayBuffer = replayBuffer
+        self.args = dotdict(dict(args))
+        self.args['numMCTSSims'] = args.reanalyseSims or args.numMCTSSims
+        self.thread = None
+        self.error = None
+        self.reanalysed = 0
+        self.rng = None
+
+    def start(self):
+        self.error = None
+        self.reanalysed = 0
+        # the thread gets its own generator, seeded from the global one, so
+        # that it does not interleave draws with self-play
+        self.rng = np.random.RandomState(np.random.randint(2 ** 31))
+        self.thread = threading.Thread(target=self._run, name='Reanalyser', daemon=True)
+        self.thread.start()
+
+    def join(self):
+        """
+        Waits for the reanalysis to finish.
+
+        Returns:
+            the number of examples whose pi was refreshed
+        """
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+        return self.reanalysed
+
+    def _run(self):
+        try:
+            self.reanalyse(self.sampleRows())
+        except Exception as e:
+            log.error(f'Reanalyse failed: {e}')
+            self.error = e
+
+    def sampleRows(self):
+        """
+        Returns:
+            rows: a fraction args.reanalyseFraction of the rows of all but the
+                  newest iteration in the replay buffer
+        """
+        segments = self.replayBuffer.iterationRows()[:-1]
+        if not segments:
+            return np.array([], dtype=np.int64)
+        candidates = np.concatenate([rows for _, rows in segments])
+        count = int(len(candidates) * self.args.reanalyseFraction)
+        return self.rng.choice(candidates, size=count, replace=False)
+
+    def reanalyse(self, rows):
+        start = time.time()
+        # boards reached from the same schedules share one search tree
+        mcts = MCTS(self.nnet, self.args)
+        for row in rows:
+            board = self.replayBuffer.boards[row].astype(int)
+            game = self.game.getGameForBoard(board)
+            self.replayBuffer.pis[row] = mcts.getActionProb(game, board, temp=1)
+            self.reanalysed += 1
+        log.info(f'Reanalysed {len(rows)} examples in {time.time() - start:.2f}s')
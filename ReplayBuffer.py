@@ -0,0 +1,440 @@
+import json
+import logging
+import os
+from collections import deque
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+def writeArrays(arrays, filename):
+    with open(filename, "wb+") as f:
+        np.savez(f, **arrays)
+
+
+class ExampleArrays():
+    """
+    Training examples in columnar form: boards, pis and vs are numpy arrays
+    with one row per example, instead of a list of (board, pi, v) tuples.
+
+    If index is given, example i is stored at row index[i] of the arrays, so
+    a subset or permutation of a larger store (e.g. a memory-mapped replay
+    buffer) can be trained on without copying it.
+
+    If weights is given, examples are sampled with probability proportional
+    to their weight, e.g. the number of duplicates merged into an example.
+    priorities optionally holds the priorities for prioritized sampling (see
+    PrioritizedReplay). Like boards, pis and vs it is a column indexed through
+    index, so that new priorities can be written back to the store, e.g. the
+    priorities column of the replay buffer. priority_updates='loss' asks the
+    trainer to replace the priorities of the examples it trains on by their
+    loss; otherwise they are left unchanged.
+
+    If boards holds preprocessed network inputs, predict_boards optionally
+    holds the boards as predict receives them during self-play (a column
+    indexed through index as well), e.g. to calibrate a quantized network on.
+    """
+
+    def __init__(self, boards, pis, vs, index=None, weights=None, priorities=None, priority_updates=None,
+                 predict_boards=None):
+        self.boards = boards
+        self.pis = pis
+        self.vs = vs
+        self.index = index
+        self.weights = weights
+        self.priorities = priorities
+        self.priority_updates = priority_updates
+        self.predict_boards = predict_boards
+        self.cumulative_weights = None if weights is None else np.cumsum(weights, dtype=np.float64)
+
+    @classmethod
+    def from_examples(cls, examples):
+        """
+        Input:
+            examples: a list of examples of the form (board, pi, v)
+
+        Returns:
+            the same examples as ExampleArrays
+        """
+        boards, pis, vs = list(zip(*examples))
+        return cls(np.array(boards), np.array(pis, dtype=np.float32), np.array(vs, dtype=np.float32))
+
+    def __len__(self):
+        return len(self.vs) if self.index is None else len(self.index)
+
+    def take(self, ids):
+        """
+        Returns:
+            boards, pis, vs: the examples with the given ids, gathered directly
+                             from the underlying arrays
+        """
+        if self.index is not None:
+            ids = self.index[ids]
+        return self.boards[ids], self.pis[ids], self.vs[ids]
+
+    def subset(self, ids):
+        """
+        Returns:
+            the examples with the given ids as ExampleArrays, sharing the
+            underlying arrays
+        """
+        index = ids if self.index is None else self.index[ids]
+        weights = None if self.weights is None else np.asarray(self.weights)[ids]
+        return ExampleArrays(self.boards, self.pis, self.vs, index=index, weights=weights, priorities=self.priorities,
+                             priority_updates=self.priority_updates, predict_boards=self.predict_boards)
+
+    def take_predict_boards(self, ids):
+        """
+        Returns:
+            the boards of the examples with the given ids as predict receives
+            them: predict_boards if given, else boards
+        """
+        boards = self.boards if self.predict_boards is None else self.predict_boards
+        return boards[ids if self.index is None else self.index[ids]]
+
+    def take_priorities(self, ids):
+        """
+        Returns:
+            the priorities of the examples with the given ids
+        """
+        return self.priorities[ids if self.index is None else self.index[ids]]
+
+    def put_priorities(self, ids, priorities):
+        """
+        Sets the priorities of the examples with the given ids.
+        """
+        self.priorities[ids if self.index is None else self.index[ids]] = priorities
+
+    def sample_ids(self, batch_size):
+        """
+        Returns:
+            ids: batch_size example ids drawn with replacement, uniformly or
+                 proportional to the weights of the examples
+        """
+        if self.weights is None:
+            return np.random.randint(len(self), size=batch_size)
+        draws = np.random.random(batch_size) * self.cumulative_weights[-1]
+        return np.searchsorted(self.cumulative_weights, draws, side='right')
+
+    def dedup(self, keys):
+        """
+        Merges examples with the same key (e.g. the same state) into one
+        example, whose pi, v (and priority) are the averages over the duplicates
+        and whose weight is their number (times their weights, if any).
+
+        Input:
+            keys: an array with, for every example, a row identifying its state
+
+        Returns:
+            the merged examples as ExampleArrays
+        """
+        ids = np.arange(len(self))
+        boards, pis, vs = self.take(ids)
+        weights = np.ones(len(self)) if self.weights is None else np.asarray(self.weights, dtype=np.float64)
+
+        keys = np.ascontiguousarray(keys).reshape(len(self), -1)
+        keys = keys.view(np.dtype((np.void, keys.dtype.itemsize * keys.shape[1]))).ravel()
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        order = np.argsort(inverse, kind='stable')
+        starts = np.searchsorted(inverse[order], np.arange(len(first)))
+
+        merged_weights = np.add.reduceat(weights[order], starts)
+        merged_pis = np.add.reduceat(pis[order] * weights[order, None], starts, axis=0) / merged_weights[:, None]
+        merged_vs = np.add.reduceat(vs[order] * weights[order], starts) / merged_weights
+        merged_priorities = None
+        if self.priorities is not None:
+            priorities = np.asarray(self.take_priorities(ids), dtype=np.float64)
+            merged_priorities = np.add.reduceat(priorities[order] * weights[order], starts) / merged_weights
+        predict_boards = None if self.predict_boards is None else self.take_predict_boards(ids)[first]
+        return ExampleArrays(boards[first], merged_pis.astype(np.float32), merged_vs.astype(np.float32),
+                             weights=merged_weights, priorities=merged_priorities,
+                             priority_updates=self.priority_updates, predict_boards=predict_boards)
+
+
+class ReplayBuffer():
+    """
+    Fixed-capacity store for self-play examples, replacing the list of deques
+    of (board, pi, r) tuples. Examples are kept in preallocated columns (boards
+    as board_dtype, int8 by default, pis as float32 or float16, rewards as
+    float32) used as a ring buffer: when the buffer is full, the oldest
+    examples are overwritten. Boards with values outside of the range of
+    board_dtype are rejected rather than wrapped around.
+
+    Every example is tagged with the iteration that produced it, so that whole
+    iterations can be evicted to keep a sliding window of history.
+
+    Next to the boards as played, the inputs column holds the boards as fed to
+    the network, computed once per example by input_fn when it is added. The
+    values column holds the value targets the network is trained on, which
+    the Coach derives from the rewards. The priorities column holds the
+    priorities of prioritized sampling, kept from one iteration to the next;
+    new examples start with the highest stored priority.
+    """
+
+    def __init__(self, capacity, board_shape, action_size, pi_dtype=np.float32, input_fn=None, board_dtype=np.int8):
+        self.capacity = capacity
+        self.board_shape = tuple(board_shape)
+        self.action_size = action_size
+        self.input_fn = input_fn
+
+        self.boards = self._allocate('boards', (capacity,) + self.board_shape, board_dtype)
+        self.inputs = self._allocate('inputs', (capacity,) + self.board_shape, np.int8)
+        self.pis = self._allocate('pis', (capacity, action_size), pi_dtype)
+        self.rewards = self._allocate('rewards', (capacity,), np.float32)
+        self.values = self._allocate('values', (capacity,), np.float32)
+        self.iterations = self._allocate('iterations', (capacity,), np.int32)
+        self.priorities = self._allocate('priorities', (capacity,), np.float32, fill=1.)
+
+        self.start = 0  # row of the oldest example
+        self.size = 0  # number of stored examples
+        self.segments = deque()  # [iteration, count] per stored iteration, oldest first
+
+    def _allocate(self, name, shape, dtype, fill=0):
+        return np.full(shape, fill, dtype=dtype)
+
+    def __len__(self):
+        return self.size
+
+    def numIterations(self):
+        return len(self.segments)
+
+    def lastIteration(self):
+        return self.segments[-1][0] if self.segments else None
+
+    def indices(self):
+        """
+        Returns:
+            rows: the rows holding the stored examples, oldest first
+        """
+        return (self.start + np.arange(self.size)) % self.capacity
+
+    def column(self, array):
+        """
+        Returns:
+            the stored part of a column (one of self.boards, self.pis, ...),
+            oldest first. This is a view unless the stored examples wrap around
+            the end of the buffer.
+        """
+        end = self.start + self.size
+        if end <= self.capacity:
+            return array[self.start:end]
+        return np.concatenate((array[self.start:], array[:end - self.capacity]))
+
+    def iterationRows(self):
+        """
+        Returns:
+            a list of (iteration, rows) with the rows holding the examples of
+            each stored iteration, oldest first
+        """
+        result = []
+        offset = self.start
+        for iteration, count in self.segments:
+            result.append((iteration, (offset + np.arange(count)) % self.capacity))
+            offset += count
+        return result
+
+    def lastIterationRows(self):
+        """
+        Returns:
+            rows: the rows holding the examples of the most recent iteration
+        """
+        count = self.segments[-1][1] if self.segments else 0
+        return (self.start + np.arange(self.size - count, self.size)) % self.capacity
+
+    def add(self, examples, iteration):
+        """
+        Appends the examples of one iteration, overwriting the oldest examples
+        if the buffer is full.
+
+        Input:
+            examples: a list of examples of the form (board, pi, r)
+            iteration: the iteration that produced the examples
+        """
+        examples = list(examples)
+        if not examples:
+            return
+        boards, pis, rewards = list(zip(*examples))
+        self.addArrays(np.asarray(boards), np.asarray(pis), np.asarray(rewards), iteration)
+
+    def addArrays(self, boards, pis, rewards, iteration, priorities=None):
+        """
+        Same as add, for examples that are already stacked into arrays, and
+        optionally their priorities.
+        """
+        boards, pis, rewards = boards[-self.capacity:], pis[-self.capacity:], rewards[-self.capacity:]
+        n = len(rewards)
+        if n == 0:
+            return
+        limits = np.iinfo(self.boards.dtype)
+        if boards.min() < limits.min or boards.max() > limits.max:
+            raise ValueError(f"Board values in [{boards.min()}, {boards.max()}] do not fit the "
+                             f"{self.boards.dtype} boards of the replay buffer")
+        if priorities is None:
+            # new examples are sampled at least as often as any stored example
+            priorities = self.column(self.priorities).max() if self.size else 1.
+        else:
+            priorities = priorities[-self.capacity:]
+
+        overflow = self.size + n - self.capacity
+        if overflow > 0:
+            log.warning(f"Replay buffer is full, overwriting the {overflow} oldest examples")
+            self._dropOldest(overflow)
+
+        rows = (self.start + self.size + np.arange(n)) % self.capacity
+        self.boards[rows] = boards
+        self.inputs[rows] = boards if self.input_fn is None else self.input_fn(boards)
+        self.pis[rows] = pis
+        self.rewards[rows] = rewards
+        self.iterations[rows] = iteration
+        self.priorities[rows] = priorities
+        self.size += n
+
+        if self.segments and self.segments[-1][0] == iteration:
+            self.segments[-1][1] += n
+        else:
+            self.segments.append([iteration, n])
+
+    def _dropOldest(self, n):
+        self.start = (self.start + n) % self.capacity
+        self.size -= n
+        while n > 0:
+            if self.segments[0][1] <= n:
+                n -= self.segments.popleft()[1]
+            else:
+                self.segments[0][1] -= n
+                n = 0
+
+    def evict(self, window):
+        """
+        Removes the oldest iterations so that at most window iterations remain.
+        """
+        while len(self.segments) > window:
+            self._dropOldest(self.segments[0][1])
+
+    def save(self, filename, writer=None):
+        """
+        Writes the stored examples (not the empty part of the buffer) to
+        filename in numpy .npz format. If a CheckpointWriter is given, a copy
+        of the examples is handed to it instead.
+        """
+        arrays = self.snapshot(copy=writer is not None)
+        if writer is None:
+            writeArrays(arrays, filename)
+        else:
+            writer.submit(filename, writeArrays, arrays)
+
+    def snapshot(self, copy=True):
+        """
+        Returns:
+            a dict of the arrays written by save
+        """
+        return {
+            'boards': np.array(self.column(self.boards), copy=copy),
+            'pis': np.array(self.column(self.pis), copy=copy),
+            'rewards': np.array(self.column(self.rewards), copy=copy),
+            'priorities': np.array(self.column(self.priorities), copy=copy),
+            'segments': np.array(self.segments, dtype=np.int64).reshape(-1, 2),
+        }
+
+    def load(self, filename):
+        """
+        Replaces the contents of the buffer with the examples saved in filename.
+        """
+        with np.load(filename) as data:
+            self.start = 0
+            self.size = 0
+            self.segments = deque()
+            segments = data['segments']
+            n = int(segments[:, 1].sum())
+            if n > self.capacity:
+                log.warning(f"Saved examples exceed replay capacity, keeping the newest {self.capacity}")
+            # examples saved before priorities were kept start with equal ones
+            priorities = data['priorities'] if 'priorities' in data else np.ones(n, dtype=np.float32)
+            offset = 0
+            for iteration, count in segments:
+                rows = slice(offset, offset + count)
+                offset += count
+                self.addArrays(data['boards'][rows], data['pis'][rows], data['rewards'][rows], int(iteration),
+                               priorities=priorities[rows])
+
+
+class MemmapReplayBuffer(ReplayBuffer):
+    """
+    ReplayBuffer whose columns are memory-mapped .npy files in folder, so the
+    size of the history is bounded by disk rather than by RAM. Only the pages
+    touched while adding and sampling are kept in memory by the OS.
+
+    A new buffer starts empty, even on a folder with the files of an earlier
+    run. The bookkeeping (oldest row, size and iterations) is saved as a
+    manifest by save(), and load() continues from it, as long as the rows it
+    describes have not been overwritten since.
+    """
+
+    def __init__(self, folder, capacity, board_shape, action_size, pi_dtype=np.float32, input_fn=None,
+                 board_dtype=np.int8):
+        self.folder = folder
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        super(MemmapReplayBuffer, self).__init__(capacity, board_shape, action_size, pi_dtype=pi_dtype,
+                                                 input_fn=input_fn, board_dtype=board_dtype)
+
+    def _allocate(self, name, shape, dtype, fill=0):
+        filename = os.path.join(self.folder, name + '.npy')
+        if os.path.isfile(filename):
+            array = np.load(filename, mmap_mode='r+')
+            if array.shape == shape and array.dtype == dtype:
+                return array
+            log.warning(f"Replay file {filename} has a different shape or type, recreating it")
+            del array
+        array = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=shape)
+        if fill:
+            array[:] = fill
+        return array
+
+    def _getState(self):
+        return {'start': int(self.start), 'size': int(self.size),
+                'segments': [[int(i), int(n)] for i, n in self.segments]}
+
+    def _setState(self, state):
+        self.start = state['start']
+        self.size = state['size']
+        self.segments = deque([list(segment) for segment in state['segments']])
+
+    def flush(self):
+        """
+        Writes the columns to disk.
+        """
+        for array in (self.boards, self.inputs, self.pis, self.rewards, self.values, self.iterations,
+                      self.priorities):
+            array.flush()
+
+    def snapshot(self, copy=True):
+        """
+        Flushes the buffer and returns its manifest, which save writes to
+        filename. The examples themselves stay in the memory-mapped files, so
+        only the most recently saved manifest matches them.
+        """
+        self.flush()
+        return {'folder': os.path.abspath(self.folder), 'state': json.dumps(self._getState())}
+
+    def load(self, filename):
+        """
+        Restores the buffer from filename: either a manifest written by save,
+        or examples saved by a ReplayBuffer, which are copied into the files.
+
+        Raises ValueError, leaving the buffer empty, if rows of the manifest
+        have been overwritten by examples of another iteration since it was
+        saved (e.g. the manifest of an older checkpoint).
+        """
+        with np.load(filename) as data:
+            if 'state' not in data:
+                return super(MemmapReplayBuffer, self).load(filename)
+            if os.path.abspath(str(data['folder'])) != os.path.abspath(self.folder):
+                log.warning(f"{filename} describes the replay buffer in {data['folder']}, not in {self.folder}")
+            self._setState(json.loads(str(data['state'])))
+        for iteration, rows in self.iterationRows():
+            if np.any(self.iterations[rows] != iteration):
+                self._setState({'start': 0, 'size': 0, 'segments': []})
+                raise ValueError(f"The examples of iteration {iteration} described by {filename} have been "
+                                 f"overwritten in {self.folder}")
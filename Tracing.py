@@ -0,0 +1,73 @@
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+
+class Tracer():
+    """
+    Records spans (episodes, MCTS simulation batches, network forward passes,
+    training steps, checkpoint writes, ...) as Chrome trace events, with the
+    process and thread ids, so a timeline can be inspected in chrome://tracing
+    or Perfetto.
+
+    Recording is off until start() is called; span() is then nearly free.
+    The module-level `tracer` is shared by all components.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.events = []
+        self.lock = threading.Lock()
+
+    def start(self):
+        with self.lock:
+            self.events = []
+        self.enabled = True
+
+    def stop(self, filename):
+        """
+        Stops recording and writes the recorded events to filename as Chrome
+        trace-event JSON.
+        """
+        self.enabled = False
+        with self.lock:
+            events, self.events = self.events, []
+        pid = os.getpid()
+        threads = {e['tid']: e.pop('thread') for e in events}
+        metadata = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                    for tid, name in threads.items()]
+        folder = os.path.dirname(filename)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': metadata + events, 'displayTimeUnit': 'ms'}, f)
+        log.info(f'Wrote {len(events)} trace events to {filename}')
+
+    @contextmanager
+    def span(self, name, cat='', **args):
+        """
+        Records the with-block as a complete ('X') event named name.
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            thread = threading.current_thread()
+            event = {'name': name, 'cat': cat, 'ph': 'X', 'ts': start * 1e6, 'dur': (end - start) * 1e6,
+                     'pid': os.getpid(), 'tid': thread.ident, 'thread': thread.name}
+            if args:
+                event['args'] = args
+            with self.lock:
+                self.events.append(event)
+
+
+tracer = Tracer()
@@ -0,0 +1,344 @@
+"""
+Benchmarks of the neural network of the planning game, to compare code
+versions and settings.
+
+Usage:
+    python benchmark.py [--channels n] [--checkpoint folder file] predict [--batch-sizes 1 8 64] [--boards 512]
+    python benchmark.py [--channels n] [--checkpoint folder file] quantize [--boards 256]
+    python benchmark.py [--channels n] [--checkpoint folder file] export [--boards 256]
+    python benchmark.py [--channels n] [--checkpoint folder file] train [--examples 4096] [--epochs 2]
+    python benchmark.py [--channels n] [--checkpoint folder file] bf16 [--examples 4096] [--epochs 2]
+    python benchmark.py zoo [--configs conv:512 resnet:64:4 ...] [--examples 1024]
+    python benchmark.py [--channels n] [--checkpoint folder file] distill [--student resnet:32:2] [--sims 25]
+    python benchmark.py [--channels n] [--checkpoint folder file] threads [--threads 1 2 4] [--cpus 0 1 2 3]
+"""
+import argparse
+import logging
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from MCTS import MCTS
+from main import makeGame
+from ReplayBuffer import ExampleArrays
+from qzero_planning.InferenceNNet import InferenceNNet
+from qzero_planning.NNet import NNetWrapper as pnn, args as nnet_args
+from utils import dotdict, set_cpu_affinity, set_seed, set_torch_threads
+
+log = logging.getLogger(__name__)
+
+
+def randomBoards(game, count):
+    """
+    Returns count canonical boards of random playouts of the game, as met
+    during self-play.
+    """
+    boards = []
+    while len(boards) < count:
+        g = game.get_copy()
+        board = g.getInitBoard()
+        while not g.getGameEnded(board) and len(boards) < count:
+            boards.append(g.getCanonicalForm(board))
+            valids = np.flatnonzero(g.getValidMoves(board))
+            board = g.getNextState(board, np.random.choice(valids))
+    return np.array(boards)
+
+
+def timeit(fn, repeat=3):
+    """
+    Returns the best time in seconds of repeat calls of fn, after a warm-up call.
+    """
+    fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def printTable(header, rows):
+    widths = [max(len(str(x)) for x in column) for column in zip(header, *rows)]
+    for row in [header] + rows:
+        print('  '.join(str(x).rjust(w) for x, w in zip(row, widths)))
+
+
+def benchmarkPredict(game, nnet, options):
+    boards = randomBoards(game, options.boards)
+    rows = []
+    seconds = timeit(lambda: [nnet.predict(board) for board in boards])
+    rows.append(['predict', 1, f'{seconds / len(boards) * 1e3:.3f}', f'{len(boards) / seconds:.0f}'])
+    for batch_size in options.batch_sizes:
+        batches = [boards[i:i + batch_size] for i in range(0, len(boards), batch_size)]
+        seconds = timeit(lambda: [nnet.predict_batch(batch) for batch in batches])
+        rows.append(['predict_batch', batch_size, f'{seconds / len(boards) * 1e3:.3f}', f'{len(boards) / seconds:.0f}'])
+    printTable(['method', 'batch', 'ms/board', 'boards/s'], rows)
+
+
+def benchmarkQuantize(game, nnet, options):
+    boards = randomBoards(game, 2 * options.boards)
+    calibration, check = boards[:options.boards], boards[options.boards:]
+    rows = []
+    for mode in [None, 'dynamic', 'static']:
+        nnet_args.quantize = mode
+        nnet.quantize(calibration)
+        kl, mse = nnet.quantization_error(check) if mode else (0., 0.)
+        single = timeit(lambda: [nnet.predict(board) for board in check[:64]]) / 64
+        batched = timeit(lambda: nnet.predict_batch(check)) / len(check)
+        rows.append([mode or 'fp32', f'{single * 1e3:.3f}', f'{batched * 1e3:.3f}', f'{kl:.2e}', f'{mse:.2e}'])
+    printTable(['model', 'ms/board', 'ms/board batched', 'policy KL', 'value MSE'], rows)
+
+
+def randomExamples(game, count):
+    """
+    Returns count examples of random playouts, with random policy and value
+    targets, as ExampleArrays.
+    """
+    boards = randomBoards(game, count)
+    pis = np.random.dirichlet(np.ones(game.getActionSize()), size=count).astype(np.float32)
+    vs = np.random.uniform(-1, 1, size=count).astype(np.float32)
+    return ExampleArrays(boards, pis, vs)
+
+
+def benchmarkTrain(game, nnet, options):
+    examples = randomExamples(game, options.examples)
+    nnet_args.epochs = options.epochs
+    start = time.perf_counter()
+    steps = nnet.train(examples)
+    seconds = time.perf_counter() - start
+    printTable(['examples', 'batch', 'steps', 'seconds', 'steps/s'],
+               [[len(examples), nnet_args.batch_size, steps, f'{seconds:.2f}', f'{steps / seconds:.1f}']])
+
+
+def losses(nnet, examples):
+    """
+    Returns the policy (cross-entropy) and value (squared error) losses of
+    nnet on all examples.
+    """
+    boards, pis, vs = examples.take(np.arange(len(examples)))
+    predicted_pis, predicted_vs = nnet.predict_batch(boards)
+    return -np.mean(np.sum(pis * np.log(predicted_pis + 1e-12), axis=1)), np.mean((vs - predicted_vs) ** 2)
+
+
+def benchmarkBf16(game, nnet, options):
+    examples = randomExamples(game, options.examples)
+    boards = examples.boards[:256]
+    nnet_args.epochs = options.epochs
+    initial = nnet.snapshot()
+    rows = []
+    for bf16 in [False, True]:
+        # the same initial weights and a fresh optimizer for both runs
+        nnet.restore(initial)
+        nnet.optimizer = None
+        nnet_args.bf16_train = nnet_args.bf16_predict = bf16
+        single = timeit(lambda: [nnet.predict(board) for board in boards[:64]]) / 64
+        batched = timeit(lambda: nnet.predict_batch(boards)) / len(boards)
+        start = time.perf_counter()
+        steps = nnet.train(examples)
+        seconds = time.perf_counter() - start
+        nnet_args.bf16_train = nnet_args.bf16_predict = False
+        l_pi, l_v = losses(nnet, examples)
+        rows.append(['bf16' if bf16 else 'fp32', f'{steps / seconds:.1f}', f'{single * 1e3:.3f}',
+                     f'{batched * 1e3:.3f}', f'{l_pi:.4f}', f'{l_v:.4f}'])
+    printTable(['precision', 'steps/s', 'ms/board', 'ms/board batched', 'loss_pi', 'loss_v'], rows)
+
+
+def benchmarkZoo(game, nnet, options):
+    examples = randomExamples(game, options.examples)
+    boards = examples.boards[:256]
+    nnet_args.epochs = 1
+    rows = []
+    for config in options.configs:
+        architecture, channels, *blocks = config.split(':')
+        nnet_args.update(architecture=architecture, num_channels=int(channels))
+        if blocks:
+            nnet_args.num_blocks = int(blocks[0])
+        nnet = pnn(game)
+        params = sum(p.numel() for p in nnet.nnet.parameters())
+        single = timeit(lambda: [nnet.predict(board) for board in boards[:32]]) / 32
+        batched = timeit(lambda: nnet.predict_batch(boards)) / len(boards)
+        start = time.perf_counter()
+        steps = nnet.train(examples)
+        seconds = time.perf_counter() - start
+        rows.append([config, f'{params / 1e6:.2f}M', f'{single * 1e3:.3f}', f'{batched * 1e3:.3f}',
+                     f'{steps / seconds:.1f}'])
+    printTable(['config', 'params', 'ms/board', 'ms/board batched', 'train steps/s'], rows)
+
+
+def playEpisodes(game, nnet, episodes, sims):
+    """
+    Plays episodes greedily with MCTS on nnet.
+
+    Returns:
+        the mean reward and the number of MCTS simulations per second
+    """
+    mcts_args = dotdict({'numMCTSSims': sims, 'cpuct': 1})
+    rewards = []
+    simulations = 0
+    start = time.perf_counter()
+    for _ in range(episodes):
+        g = game.get_copy()
+        board = g.getInitBoard()
+        mcts = MCTS(nnet, mcts_args)
+        while True:
+            board = g.getNextState(board, np.argmax(mcts.getActionProb(g, board, temp=0)))
+            simulations += sims
+            r = g.getGameEnded(board)
+            if r:
+                rewards.append(r)
+                break
+    return np.mean(rewards), simulations / (time.perf_counter() - start)
+
+
+def benchmarkDistill(game, nnet, options):
+    architecture, channels, blocks = options.student.split(':')
+    student = pnn(game, architecture=architecture, num_channels=int(channels), num_blocks=int(blocks))
+    boards = randomBoards(game, 2 * options.boards)
+    nnet_args.epochs = options.epochs
+    student.distill_from(nnet, boards[:options.boards])
+
+    pis, vs = nnet.predict_batch(boards[options.boards:])
+    rows = []
+    for name, net in [('teacher', nnet), ('student ' + options.student, student)]:
+        params = sum(p.numel() for p in net.nnet.parameters())
+        student_pis, student_vs = net.predict_batch(boards[options.boards:])
+        kl = np.mean(np.sum(pis * (np.log(pis + 1e-12) - np.log(student_pis + 1e-12)), axis=1))
+        reward, sims_per_sec = playEpisodes(game, net, options.episodes, options.sims)
+        rows.append([name, f'{params / 1e6:.2f}M', f'{kl:.2e}', f'{np.mean((vs - student_vs) ** 2):.2e}',
+                     f'{sims_per_sec:.0f}', f'{reward:.4g}'])
+    printTable(['network', 'params', 'policy KL', 'value MSE', 'sims/s', 'mean reward'], rows)
+
+
+def benchmarkThreads(game, nnet, options):
+    if options.cpus:
+        set_cpu_affinity(options.cpus)
+    cores = len(os.sched_getaffinity(0))
+    examples = randomExamples(game, options.examples)
+    boards = examples.boards[:256]
+    nnet_args.epochs = 1
+    nnet.train(examples.subset(np.arange(2 * nnet_args.batch_size)))  # warm-up, creates the optimizer
+    rows = []
+    for threads in options.threads or sorted({1, 2, max(1, cores // 2), cores}):
+        nnet_args.train_threads = nnet_args.predict_threads = threads
+        set_torch_threads(threads)
+        single = timeit(lambda: [nnet.predict(board) for board in boards[:32]]) / 32
+        batched = timeit(lambda: nnet.predict_batch(boards)) / len(boards)
+        start = time.perf_counter()
+        steps = nnet.train(examples)
+        seconds = time.perf_counter() - start
+        rows.append([threads, cores, f'{single * 1e3:.3f}', f'{batched * 1e3:.3f}', f'{steps / seconds:.1f}'])
+    printTable(['threads', 'cpus', 'ms/board', 'ms/board batched', 'train steps/s'], rows)
+
+
+# loads a network in a fresh process and predicts once, to measure startup time and memory
+STARTUP = """
+import time
+start = time.perf_counter()
+import pickle, resource, sys
+sys.path.insert(0, {root!r})
+from {module} import {cls} as Net
+game = pickle.load(open({game!r}, 'rb'))
+nnet = Net(game)
+nnet.load_checkpoint({folder!r}, {filename!r})
+nnet.predict(game.getInitBoard())
+print(time.perf_counter() - start, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.)
+"""
+
+
+def benchmarkExport(game, nnet, options):
+    boards = randomBoards(game, options.boards)
+    folder = tempfile.mkdtemp()
+    with open(os.path.join(folder, 'game.pkl'), 'wb') as f:
+        pickle.dump(game, f)
+    nnet.save_checkpoint(folder, 'best.pth.tar')
+    backends = [('NNetWrapper', 'qzero_planning.NNet', 'NNetWrapper', 'best.pth.tar', nnet)]
+    nnet.export(folder, 'best.pt')
+    backends.append(('TorchScript', 'qzero_planning.InferenceNNet', 'InferenceNNet', 'best.pt', None))
+    try:
+        nnet.export(folder, 'best.onnx')
+        import onnxruntime
+        backends.append(('ONNX', 'qzero_planning.InferenceNNet', 'InferenceNNet', 'best.onnx', None))
+    except ImportError as e:
+        log.warning(f'Skipping ONNX: {e}')
+
+    rows = []
+    for name, module, cls, filename, net in backends:
+        code = STARTUP.format(root=os.path.dirname(os.path.abspath(__file__)), module=module, cls=cls,
+                              game=os.path.join(folder, 'game.pkl'), folder=folder, filename=filename)
+        startup, rss = map(float, subprocess.check_output([sys.executable, '-c', code]).split()[-2:])
+        net = net or InferenceNNet(game, os.path.join(folder, filename))
+        single = timeit(lambda: [net.predict(board) for board in boards[:64]]) / 64
+        batched = timeit(lambda: net.predict_batch(boards)) / len(boards)
+        rows.append([name, f'{startup:.2f}', f'{rss:.0f}', f'{single * 1e3:.3f}', f'{batched * 1e3:.3f}'])
+    printTable(['backend', 'startup s', 'peak RSS MB', 'ms/board', 'ms/board batched'], rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--channels', type=int, help='num_channels of the network (default: NNet args)')
+    parser.add_argument('--checkpoint', nargs=2, metavar=('FOLDER', 'FILE'), help='network to benchmark (default: untrained)')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    predict = subparsers.add_parser('predict', help='latency of predict vs predict_batch')
+    predict.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 64])
+    predict.add_argument('--boards', type=int, default=512)
+    predict.set_defaults(run=benchmarkPredict)
+
+    quantize = subparsers.add_parser('quantize', help='latency and accuracy of the int8 quantized network')
+    quantize.add_argument('--boards', type=int, default=256, help='number of calibration (and of check) boards')
+    quantize.set_defaults(run=benchmarkQuantize)
+
+    export = subparsers.add_parser('export', help='startup time and latency of the exported inference backends')
+    export.add_argument('--boards', type=int, default=256)
+    export.set_defaults(run=benchmarkExport)
+
+    train = subparsers.add_parser('train', help='training throughput')
+    train.add_argument('--examples', type=int, default=4096)
+    train.add_argument('--epochs', type=int, default=2)
+    train.set_defaults(run=benchmarkTrain)
+
+    bf16 = subparsers.add_parser('bf16', help='training throughput, latency and final losses, fp32 vs bfloat16')
+    bf16.add_argument('--examples', type=int, default=4096)
+    bf16.add_argument('--epochs', type=int, default=2)
+    bf16.set_defaults(run=benchmarkBf16)
+
+    zoo = subparsers.add_parser('zoo', help='parameters, latency and training throughput per architecture')
+    zoo.add_argument('--configs', nargs='+',
+                     default=['conv:512', 'conv:128', 'resnet:32:2', 'resnet:64:4', 'resnet:128:6', 'fcn:64:4'],
+                     help='architecture:num_channels[:num_blocks]')
+    zoo.add_argument('--examples', type=int, default=1024)
+    zoo.set_defaults(run=benchmarkZoo)
+
+    distill = subparsers.add_parser('distill', help='agreement, MCTS speed and strength of a distilled student')
+    distill.add_argument('--student', default='resnet:32:2', help='architecture:num_channels:num_blocks')
+    distill.add_argument('--boards', type=int, default=2048, help='number of boards to distill on (and to compare on)')
+    distill.add_argument('--epochs', type=int, default=10)
+    distill.add_argument('--episodes', type=int, default=5)
+    distill.add_argument('--sims', type=int, default=25)
+    distill.set_defaults(run=benchmarkDistill)
+
+    threads = subparsers.add_parser('threads', help='inference latency and training throughput per thread count')
+    threads.add_argument('--threads', type=int, nargs='+', help='intra-op thread counts (default: 1, 2, half and all cpus)')
+    threads.add_argument('--cpus', type=int, nargs='+', help='cpu ids to pin the process to')
+    threads.add_argument('--examples', type=int, default=1024)
+    threads.set_defaults(run=benchmarkThreads)
+
+    options = parser.parse_args()
+    set_seed(options.seed)
+    if options.channels:
+        nnet_args.num_channels = options.channels
+    game = makeGame()
+    nnet = pnn(game)
+    if options.checkpoint:
+        nnet.load_checkpoint(*options.checkpoint)
+    options.run(game, nnet, options)
+
+
+if __name__ == "__main__":
+    main()
@@ -61,6 +61,16 @@ class NNetWrapper(NeuralNet):
         #print('PREDICTION TIME TAKEN : {0:03f}'.format(time.time()-start))
         return pi[0], v[0]
 
+    def predict_batch(self, boards):
+        """
+        boards: np array (or list) of boards
+        """
+        boards = np.asarray(boards)
+
+        # predict_on_batch runs one forward pass, without the per-call overhead of predict
+        pis, vs = self.nnet.model.predict_on_batch(boards)
+        return np.asarray(pis), np.asarray(vs).reshape(-1)
+
     def save_checkpoint(self, folder='checkpoint', filename='checkpoint.pth.tar'):
         # change extension
         filename = filename.split(".")[0] + ".h5"
@@ -66,6 +66,18 @@ class NNetWrapper(NeuralNet):
 
         return pi[0], v[0]
 
+    def predict_batch(self, boards):
+        """
+        boards: np array (or list) of boards
+        """
+
+        boards = np.array(boards)
+        normalize_score(boards)
+
+        pis, vs = self.nnet.model.predict_on_batch(boards)
+
+        return np.asarray(pis), np.asarray(vs).reshape(-1)
+
     def save_checkpoint(self, folder='checkpoint', filename='checkpoint.pth.tar'):
         # change extension
         filename = filename.split(".")[0] + ".h5"
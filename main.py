@@ -23,16 +23,40 @@ args = dotdict({
     'numMCTSSims': 25,          # Number of games moves for MCTS to simulate.
     'arenaCompare': 40,         # Number of games to play during arena play to determine if new net will be accepted.
     'cpuct': 1,
+    'seed': None,               # Seed of all random number generators, for reproducible (e.g. benchmark) runs.
+    'cpuAffinity': None,        # CPU ids to pin this process to (e.g. [0, 1, 2, 3]); thread counts are NNet args.
 
     'checkpoint': './temp/',
+    'asyncCheckpoints': True,   # Write checkpoints and examples on a background thread.
+    'keepCheckpoints': None,    # Number of most recent checkpoint_N files to keep (None keeps all).
+    'exportModel': None,        # Export accepted networks to this file in the checkpoint folder for InferenceNNet ('best.pt' for TorchScript, 'best.onnx' for ONNX).
+    'selfPlayBackend': None,    # 'torchscript' or 'onnx' to run self-play MCTS on the network exported to that backend every iteration (InferenceNNet).
+    'metricsFile': 'metrics.jsonl',  # Per-iteration performance metrics (JSON lines) in the checkpoint folder, None to disable.
+    'prometheusFile': None,     # Also write the latest metrics in Prometheus text format to this file.
+    'profileIters': [],         # Iterations to profile with cProfile, per phase; profiles go to the checkpoint folder.
+    'profilePhases': None,      # Phases to profile (e.g. ['selfplay', 'train']), None for all.
+    'traceIters': [],           # Iterations to record as a Chrome trace (trace_<i>.json in the checkpoint folder).
+    'resume': False,            # Resume the run saved in the checkpoint folder, including examples and iteration.
     'load_model': False,
     'load_folder_file': ('/dev/models/8x100x50','best.pth.tar'),
     'numItersForTrainExamplesHistory': 20,
+    'replayCapacity': None,     # Maximum number of examples kept in the replay buffer (default: maxlenOfQueue * numItersForTrainExamplesHistory).
+    'replayPiDtype': 'float32', # Storage type of the policy targets in the replay buffer ('float16' halves their memory).
+    'replayBackend': 'memory',  # 'memory', or 'memmap' to keep the replay buffer in memory-mapped files on disk.
+    'replayFolder': None,       # Folder of the memory-mapped replay buffer (default: <checkpoint>/replay).
+    'rankedRewardPercentile': 75,  # Rewards above this percentile are ranked 1, the others 0.
+    'rankedRewardWindow': 1,    # Number of latest iterations whose rewards the percentile is taken over.
+    'replayPriorities': None,   # 'rank' to sample training examples by the rank of their reward, 'loss' by their last training loss, kept in the replay buffer across iterations, see PrioritizedReplay.
+    'dedupExamples': False,     # Merge examples of identical states, averaging their targets and weighting them by count.
+    'reanalyseFraction': 0.0,   # Fraction of older examples whose policy targets are refreshed with the current network during self-play.
+    'reanalyseSims': None,      # Number of MCTS simulations when reanalysing (default: numMCTSSims).
+    'studentArgs': None,        # Network args of a small student (e.g. {'architecture': 'resnet', 'num_channels': 32, 'num_blocks': 2}), distilled from the trained network every iteration and used by self-play MCTS.
+    'distillBoards': 20000,     # Maximum number of boards the student is distilled on per iteration, from the last iteration and, if it has fewer, the whole replay buffer (None: the whole buffer).
 
 })
 
 
-def main():
+def makeGame():
     domainactions = [DomainAction(urn=1, duration=2), DomainAction(urn=2, duration=2),
                      DomainAction(urn=3, duration=1), DomainAction(urn=4, duration=1),
                      DomainAction(urn=5, duration=2), DomainAction(urn=6, duration=1)]
@@ -41,8 +65,20 @@ def main():
 
     log.info(f'Loading {PlanningGame.__name__}...')
     # g = PlanningGame(machines=machines, timesteps=timesteps, domainactions=domainactions,rewardstrategy=MinSpanTimeRewardStrategy(-((machines*timesteps) + 1)))
-    g = PlanningGame(machines=machines, timesteps=timesteps, domainactions=domainactions,rewardstrategy=RelativeProductRewardStrategy(-((machines**timesteps)+1)))
-    
+    return PlanningGame(machines=machines, timesteps=timesteps, domainactions=domainactions,rewardstrategy=RelativeProductRewardStrategy(-((machines**timesteps)+1)))
+
+
+def main():
+    if args.seed is not None:
+        log.info(f'Seeding random number generators with {args.seed}')
+        set_seed(args.seed)
+
+    if args.cpuAffinity:
+        log.info(f'Pinning to CPUs {args.cpuAffinity}')
+        set_cpu_affinity(args.cpuAffinity)
+
+    g = makeGame()
+
     log.info('Loading %s...', pnn.__name__)
     nnet = pnn(g)
 
@@ -55,7 +91,8 @@ def main():
     log.info('Loading the Coach...')
     c = Coach(g, nnet, args)
 
-    if args.load_model:
+    resumed = args.resume and c.loadRunState()
+    if args.load_model and not resumed:
         log.info("Loading 'trainExamples' from file...")
         c.loadTrainExamples()
 
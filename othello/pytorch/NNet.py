@@ -93,12 +93,37 @@ class NNetWrapper(NeuralNet):
         # print('PREDICTION TIME TAKEN : {0:03f}'.format(time.time()-start))
         return torch.exp(pi).data.cpu().numpy()[0], v.data.cpu().numpy()[0]
 
+    def predict_batch(self, boards):
+        """
+        boards: np array (or list) of boards
+        """
+        boards = torch.from_numpy(np.asarray(boards, dtype=np.float32))
+        if args.cuda: boards = boards.contiguous().cuda()
+        boards = boards.view(-1, self.board_x, self.board_y)
+        self.nnet.eval()
+        with torch.no_grad():
+            pi, v = self.nnet(boards)
+
+        return torch.exp(pi).data.cpu().numpy(), v.data.cpu().numpy().reshape(-1)
+
     def loss_pi(self, targets, outputs):
         return -torch.sum(targets * outputs) / targets.size()[0]
 
     def loss_v(self, targets, outputs):
         return torch.sum((targets - outputs.view(-1)) ** 2) / targets.size()[0]
 
+    def snapshot(self):
+        return {
+            'state_dict': {k: v.detach().clone() for k, v in self.nnet.state_dict().items()},
+        }
+
+    def restore(self, snapshot):
+        self.nnet.load_state_dict(snapshot['state_dict'])
+
+    def clone_from(self, other):
+        # load_state_dict copies the tensors, so no intermediate snapshot is needed
+        self.nnet.load_state_dict(other.nnet.state_dict())
+
     def save_checkpoint(self, folder='checkpoint', filename='checkpoint.pth.tar'):
         filepath = os.path.join(folder, filename)
         if not os.path.exists(folder):
@@ -0,0 +1,66 @@
+import logging
+import os
+import sys
+
+import numpy as np
+
+sys.path.append('../')
+from NeuralNet import NeuralNet
+
+log = logging.getLogger(__name__)
+
+
+class InferenceNNet(NeuralNet):
+    """
+    Inference-only network of the planning game, loaded from a model exported
+    by NNetWrapper.export: TorchScript (.pt) is run with torch.jit, ONNX
+    (.onnx) with onnxruntime. It implements predict and predict_batch only,
+    without building the PlanningNNet module, the optimizer or any training
+    state, for self-play workers and serving processes.
+    """
+
+    def __init__(self, game, filepath=None):
+        self.board_x, self.board_y = game.getBoardSize()
+        self.action_size = game.getActionSize()
+        self.model = None
+        self.session = None
+        if filepath is not None:
+            self.load_checkpoint(*os.path.split(filepath))
+
+    def train(self, examples, num_new_examples=None):
+        raise NotImplementedError('InferenceNNet cannot be trained, train a NNetWrapper and export it')
+
+    def predict(self, board):
+        """
+        board: np array with board
+        """
+        pis, vs = self.predict_batch(board[np.newaxis])
+        return pis[0], vs[:1]
+
+    def predict_batch(self, boards):
+        """
+        boards: np array (or list) of boards
+        """
+        boards = np.asarray(boards, dtype=np.float32).reshape(-1, self.board_x, self.board_y)
+        if self.session is not None:
+            log_pis, vs = self.session.run(None, {'boards': boards})
+        else:
+            import torch
+            with torch.no_grad():
+                log_pis, vs = self.model(torch.from_numpy(boards))
+            log_pis, vs = log_pis.numpy(), vs.numpy()
+        return np.exp(log_pis), vs.reshape(-1)
+
+    def load_checkpoint(self, folder, filename):
+        filepath = os.path.join(folder, filename)
+        if not os.path.exists(filepath):
+            raise FileNotFoundError(f'No model in path {filepath}')
+        if filepath.endswith('.onnx'):
+            import onnxruntime
+            self.session = onnxruntime.InferenceSession(filepath, providers=['CPUExecutionProvider'])
+            self.model = None
+        else:
+            import torch
+            self.model = torch.jit.load(filepath, map_location='cpu').eval()
+            self.session = None
+        log.info(f'Loaded exported model {filepath}')
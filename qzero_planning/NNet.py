@@ -1,3 +1,6 @@
+import copy
+import inspect
+import logging
 import os
 import sys
 import time
@@ -8,90 +11,341 @@ from tqdm import tqdm
 sys.path.append('../')
 from utils import *
 from NeuralNet import NeuralNet
+from PrioritizedReplay import PrioritizedSampler
+from ReplayBuffer import ExampleArrays
+from Tracing import tracer
 
 import torch
 import torch.optim as optim
 
-from .PlanningNNet import PlanningNNet as pnnet
+from .PlanningNNet import build_nnet
+
+log = logging.getLogger(__name__)
 
 args = dotdict({
     'lr': 0.001,
     'dropout': 0.3,
     'epochs': 10,
+    'steps_per_new_example': None,  # if set, train this many gradient steps per new example instead of `epochs` epochs
     'batch_size': 64,
+    'tensor_cache_bytes': 256 * 2 ** 20,  # train on float32 tensors of all examples built once if they fit in this many bytes, else gather every batch from the (possibly memory-mapped) examples
+    'validation_split': 0.0,  # fraction of the examples held out to compute a validation loss after every epoch
+    'patience': None,  # with a validation split: stop after this many epochs without a lower validation loss
+    'prioritized_replay': None,  # 'loss' to sample examples by their last training loss using a sum-tree
+    'priority_alpha': 0.6,
+    'priority_beta': 0.4,
     'cuda': torch.cuda.is_available(),
+    'train_threads': None,  # PyTorch intra-op threads while training (None: PyTorch's default, one per core)
+    'predict_threads': None,  # idem outside of training, i.e. for self-play, arena and reanalyse inference
+    'interop_threads': None,  # PyTorch inter-op threads, set once per process
+    'architecture': 'conv',  # 'conv' (4 convolutions and 2 linear layers), 'resnet' (residual tower) or 'fcn' (board-size independent), see PlanningNNet.ARCHITECTURES
     'num_channels': 512,
+    'num_blocks': 6,  # residual blocks of 'resnet' and 'fcn'
+    'bf16_train': False,  # run the forward passes of train under bfloat16 autocast on CPU
+    'bf16_predict': False,  # idem for predict; only pays off for batches, single boards get slower
+    'quantize': None,  # 'static' (int8 convs and linears) or 'dynamic' (int8 linears): predict on CPU with an int8 copy of the network
+    'quantize_calibration': 256,  # number of training boards to calibrate the static quantization on (and as many to check its accuracy)
 })
 
 
 class NNetWrapper(NeuralNet):
-    def __init__(self, game):
-        self.nnet = pnnet(game, args)
+    def __init__(self, game, **overrides):
+        """
+        overrides: args of the network itself (architecture, num_channels, ...)
+                   that differ from args, e.g. for a distilled student network
+        """
+        self.nnet = build_nnet(game, dotdict(dict(args, **overrides)) if overrides else args)
         self.board_x, self.board_y = game.getBoardSize()
         self.action_size = game.getActionSize()
+        self.optimizer = None
+        self.qnet = None  # int8 copy of nnet used by predict, see quantize()
+        self.calibration_boards = None
 
         if args.cuda:
             self.nnet.cuda()
+        set_torch_threads(args.predict_threads, args.interop_threads)
 
-    def train(self, examples):
+    def train(self, examples, num_new_examples=None):
         """
-        examples: list of examples, each example is of form (board, pi, v)
+        examples: ExampleArrays, or a list of examples, each example is of form (board, pi, v)
+        num_new_examples: number of examples added since the previous call, used
+                          with args.steps_per_new_example to size the training budget
+
+        The optimizer is kept across calls, so its state carries over from one
+        iteration to the next.
+
+        Batches are sampled uniformly, unless args.prioritized_replay is set or
+        the examples come with priorities; then a PrioritizedSampler is used and
+        the losses are corrected with importance-sampling weights. With
+        prioritized_replay='loss', or examples with priority_updates='loss',
+        the losses become the new priorities, which are also written back to
+        the priorities of the examples, if any.
+
+        With args.validation_split, that fraction of the examples is held out
+        and the validation loss is computed after every epoch. Training stops
+        early after args.patience epochs without improvement, and the weights
+        of the epoch with the lowest validation loss are kept.
+
+        Returns the number of gradient steps taken.
         """
-        optimizer = optim.Adam(self.nnet.parameters())
+        if not isinstance(examples, ExampleArrays):
+            examples = ExampleArrays.from_examples(examples)
+        if self.optimizer is None:
+            self.optimizer = optim.Adam(self.nnet.parameters(), lr=args.lr)
+
+        validation = None
+        validation_count = int(len(examples) * args.validation_split)
+        if validation_count:
+            ids = np.random.permutation(len(examples))
+            validation = examples.subset(ids[:validation_count])
+            validation_tensors = self.to_tensors(validation)
+            examples = examples.subset(ids[validation_count:])
 
-        for epoch in range(args.epochs):
-            print('EPOCH ::: ' + str(epoch + 1))
-            self.nnet.train()
-            pi_losses = AverageMeter()
-            v_losses = AverageMeter()
+        batch_count = int(len(examples) / args.batch_size)
+        if args.steps_per_new_example and num_new_examples:
+            batch_count = max(batch_count, 1)
+            total_steps = max(1, int(args.steps_per_new_example * num_new_examples))
+            epochs = -(-total_steps // batch_count)
+        else:
+            total_steps = args.epochs * batch_count
+            epochs = args.epochs
+
+        sampler = None
+        if args.prioritized_replay or examples.priorities is not None:
+            priorities = None if examples.priorities is None else examples.take_priorities(np.arange(len(examples)))
+            sampler = PrioritizedSampler(len(examples), weights=examples.weights, priorities=priorities,
+                                         alpha=args.priority_alpha, beta=args.priority_beta)
+
+        # restored afterwards, also if training fails: predict runs with the previous count
+        threads = torch.get_num_threads()
+        set_torch_threads(args.train_threads)
+        try:
+            start = time.time()
+            # gathered and converted once if small enough, so batches are plain tensor indexing
+            tensors = self.to_tensors(examples)
+            steps = 0
+            best_loss, best_state, best_epoch = float('inf'), None, 0
+            for epoch in range(epochs):
+                print('EPOCH ::: ' + str(epoch + 1))
+                self.nnet.train()
+                pi_losses = AverageMeter()
+                v_losses = AverageMeter()
+
+                t = tqdm(range(min(batch_count, total_steps - epoch * batch_count)), desc='Training Net')
+                for _ in t:
+                    with tracer.span('train_step', 'train'):
+                        self.train_step(examples, tensors, sampler, pi_losses, v_losses)
+                    t.set_postfix(Loss_pi=pi_losses, Loss_v=v_losses)
+                    steps += 1
 
-            batch_count = int(len(examples) / args.batch_size)
+                if validation is None:
+                    continue
+                loss = self.validation_loss(validation, validation_tensors)
+                log.info(f'Epoch {epoch + 1}: validation loss {loss:.4f}')
+                if loss < best_loss:
+                    best_loss, best_epoch = loss, epoch + 1
+                    best_state = {k: v.detach().clone() for k, v in self.nnet.state_dict().items()}
+                elif args.patience and epoch + 1 - best_epoch >= args.patience:
+                    log.info(f'Stopping early after epoch {epoch + 1} of {epochs}, saved {epochs - epoch - 1} epochs')
+                    break
 
-            t = tqdm(range(batch_count), desc='Training Net')
-            for _ in t:
-                sample_ids = np.random.randint(len(examples), size=args.batch_size)
-                boards, pis, vs = list(zip(*[examples[i] for i in sample_ids]))
-                boards = torch.FloatTensor(np.array(boards).astype(np.float64))
-                target_pis = torch.FloatTensor(np.array(pis))
-                target_vs = torch.FloatTensor(np.array(vs).astype(np.float64))
+            if best_state is not None:
+                log.info(f'Restoring the weights of epoch {best_epoch} (validation loss {best_loss:.4f})')
+                self.nnet.load_state_dict(best_state)
 
-                # predict
-                if args.cuda:
-                    boards, target_pis, target_vs = boards.contiguous().cuda(), target_pis.contiguous().cuda(), target_vs.contiguous().cuda()
+            elapsed = time.time() - start
+        finally:
+            set_torch_threads(threads)
+        log.info(f"Trained {steps} steps on {len(examples)} examples in {elapsed:.2f}s "
+                 f"({steps / max(elapsed, 1e-9):.1f} steps/s)")
 
-                # compute output
-                out_pi, out_v = self.nnet(boards)
-                l_pi = self.loss_pi(target_pis, out_pi)
-                l_v = self.loss_v(target_vs, out_v)
-                total_loss = l_pi + l_v
+        if args.quantize:
+            ids = np.random.permutation(len(examples))[:2 * args.quantize_calibration]
+            # the boards self-play predicts on, which need not be the training inputs
+            boards = examples.take_predict_boards(ids)
+            # calibrate on one half, check the accuracy on the other
+            n = (len(boards) + 1) // 2
+            self.quantize(boards[:n])
+            if self.qnet is not None and len(boards) > n:
+                kl, mse = self.quantization_error(boards[n:])
+                log.info(f'Quantized network: policy KL {kl:.2e}, value MSE {mse:.2e}')
+        return steps
 
-                # record loss
-                pi_losses.update(l_pi.item(), boards.size(0))
-                v_losses.update(l_v.item(), boards.size(0))
-                t.set_postfix(Loss_pi=pi_losses, Loss_v=v_losses)
+    def to_tensors(self, examples):
+        """
+        Returns:
+            boards, pis, vs: all examples as contiguous float32 tensors, on the
+                             GPU if args.cuda, or None if the examples are
+                             memory-mapped or their tensors would exceed
+                             args.tensor_cache_bytes; batches are then gathered
+                             from the examples one at a time (see batch)
+        """
+        row_size = self.board_x * self.board_y + self.action_size + 1
+        if isinstance(examples.boards, np.memmap) or isinstance(examples.pis, np.memmap) \
+                or len(examples) * row_size * 4 > args.tensor_cache_bytes:
+            return None
+        return self.batch(examples, None, np.arange(len(examples)))
+
+    def batch(self, examples, tensors, ids):
+        """
+        Returns:
+            boards, pis, vs: the examples with the given ids as float32 tensors,
+                             indexed from tensors (see to_tensors) if given,
+                             else gathered from examples
+        """
+        if tensors is not None:
+            ids = torch.from_numpy(ids).to(tensors[0].device)
+            return [x[ids] for x in tensors]
+        tensors = [torch.from_numpy(np.ascontiguousarray(x, dtype=np.float32)) for x in examples.take(ids)]
+        if args.cuda:
+            tensors = [x.cuda() for x in tensors]
+        return tensors
+
+    def validation_loss(self, examples, tensors):
+        """
+        Returns the mean policy plus value loss over the examples, with the
+        network in evaluation mode.
+
+        tensors: the examples as returned by to_tensors
+        """
+        self.nnet.eval()
+        l_pi = l_v = 0.
+        with torch.no_grad():
+            for i in range(0, len(examples), args.batch_size):
+                ids = np.arange(i, min(i + args.batch_size, len(examples)))
+                boards, target_pis, target_vs = self.batch(examples, tensors, ids)
+                with self.autocast(args.bf16_train):
+                    out_pi, out_v = self.nnet(boards)
+                l_pi += -torch.sum(target_pis * out_pi.float()).item()
+                l_v += torch.sum((target_vs - out_v.float().view(-1)) ** 2).item()
+        return (l_pi + l_v) / len(examples)
+
+    def train_step(self, examples, tensors, sampler, pi_losses, v_losses):
+        """
+        Samples one batch and takes one gradient step on it.
+
+        tensors: the examples as returned by to_tensors
+        """
+        if sampler is None:
+            sample_ids = examples.sample_ids(args.batch_size)
+        else:
+            sample_ids, is_weights = sampler.sample(args.batch_size)
+        boards, target_pis, target_vs = self.batch(examples, tensors, sample_ids)
+
+        # compute output, the losses are computed in float32
+        with self.autocast(args.bf16_train):
+            out_pi, out_v = self.nnet(boards)
+        out_pi, out_v = out_pi.float(), out_v.float()
+        if sampler is None:
+            l_pi = self.loss_pi(target_pis, out_pi)
+            l_v = self.loss_v(target_vs, out_v)
+        else:
+            l_pis = -torch.sum(target_pis * out_pi, dim=1)
+            l_vs = (target_vs - out_v.view(-1)) ** 2
+            weights = torch.from_numpy(is_weights).to(l_pis.device)
+            l_pi = torch.mean(weights * l_pis)
+            l_v = torch.mean(weights * l_vs)
+            if 'loss' in (args.prioritized_replay, examples.priority_updates):
+                losses = (l_pis + l_vs).detach().cpu().numpy()
+                sampler.update(sample_ids, losses)
+                if examples.priorities is not None:
+                    # kept by the owner of the examples (e.g. the replay buffer) for the next call
+                    examples.put_priorities(sample_ids, losses)
+        total_loss = l_pi + l_v
 
-                # compute gradient and do SGD step
-                optimizer.zero_grad()
-                total_loss.backward()
-                optimizer.step()
+        # record loss
+        pi_losses.update(l_pi.item(), boards.size(0))
+        v_losses.update(l_v.item(), boards.size(0))
+
+        # compute gradient and do SGD step
+        self.optimizer.zero_grad()
+        total_loss.backward()
+        self.optimizer.step()
 
     def predict(self, board):
         """
         board: np array with board
         """
-        # timing
-        start = time.time()
+        pis, vs = self.predict_batch(board[np.newaxis])
+        return pis[0], vs[:1]
+
+    def predict_batch(self, boards):
+        """
+        boards: np array (or list) of boards
 
-        # preparing input
-        board = torch.FloatTensor(board.astype(np.float64))
-        if args.cuda: board = board.contiguous().cuda()
-        board = board.view(1, self.board_x, self.board_y)
+        Returns the policies, shape (len(boards), action_size), and the values,
+        shape (len(boards),), of all boards, evaluated in one forward pass.
+        """
+        boards = torch.from_numpy(np.asarray(boards, dtype=np.float32))
+        if args.cuda: boards = boards.contiguous().cuda()
+        boards = boards.view(-1, self.board_x, self.board_y)
         self.nnet.eval()
+        net = self.nnet if self.qnet is None else self.qnet
+        with torch.no_grad(), self.autocast(args.bf16_predict and self.qnet is None):
+            with tracer.span('predict', 'nn', batch=boards.size(0)):
+                pi, v = net(boards)
+
+        return torch.exp(pi.float()).data.cpu().numpy(), v.float().data.cpu().numpy().reshape(-1)
+
+    def autocast(self, enabled):
+        """
+        Returns the bfloat16 autocast context of a forward pass, if enabled and
+        on CPU. bfloat16 has the exponent range of float32, so unlike float16
+        it needs no loss scaling.
+        """
+        return torch.autocast('cpu', dtype=torch.bfloat16, enabled=enabled and not args.cuda)
+
+    def quantize(self, boards=None):
+        """
+        Builds the int8 copy of the network that predict uses, according to
+        args.quantize: 'static' quantizes the convolutions and linear layers
+        (with batch norms folded in), calibrating the activation ranges on
+        boards; 'dynamic' only quantizes the weights of the linear layers.
+        Training continues on the float network, so the copy is rebuilt after
+        every train call.
+
+        boards: calibration boards, by default those of the previous call
+        """
+        self.qnet = None
+        if not args.quantize:
+            return
+        if args.cuda:
+            log.warning('Quantized inference is only supported on CPU, predicting with the float network')
+            return
+        from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+        from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+        model = copy.deepcopy(self.nnet).eval()
+        if args.quantize == 'dynamic':
+            self.qnet = quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+            return
+        if args.quantize != 'static':
+            raise ValueError(f'Unknown quantization {args.quantize}')
+
+        if boards is not None:
+            self.calibration_boards = boards
+        if self.calibration_boards is None:
+            # e.g. after loading a checkpoint: quantize after the next training
+            return
+        boards = torch.from_numpy(np.asarray(self.calibration_boards, dtype=np.float32))
+        boards = boards.view(-1, self.board_x, self.board_y)
+        prepared = prepare_fx(model, get_default_qconfig_mapping(), example_inputs=(boards[:1],))
         with torch.no_grad():
-            pi, v = self.nnet(board)
+            for i in range(0, len(boards), args.batch_size):
+                prepared(boards[i:i + args.batch_size])
+        self.qnet = convert_fx(prepared)
 
-        # print('PREDICTION TIME TAKEN : {0:03f}'.format(time.time()-start))
-        return torch.exp(pi).data.cpu().numpy()[0], v.data.cpu().numpy()[0]
+    def quantization_error(self, boards):
+        """
+        Returns the mean KL divergence of the quantized policies from the float
+        ones, and the mean squared error of the quantized values, on boards.
+        """
+        qnet, self.qnet = self.qnet, None
+        pis, vs = self.predict_batch(boards)
+        self.qnet = qnet
+        qpis, qvs = self.predict_batch(boards)
+        kl = np.sum(pis * (np.log(pis + 1e-12) - np.log(qpis + 1e-12)), axis=1)
+        return float(np.mean(kl)), float(np.mean((vs - qvs) ** 2))
 
     def loss_pi(self, targets, outputs):
         return -torch.sum(targets * outputs) / targets.size()[0]
@@ -99,17 +353,72 @@ class NNetWrapper(NeuralNet):
     def loss_v(self, targets, outputs):
         return torch.sum((targets - outputs.view(-1)) ** 2) / targets.size()[0]
 
-    def save_checkpoint(self, folder='checkpoint', filename='checkpoint.pth.tar'):
+    def snapshot(self):
+        return {
+            'state_dict': {k: v.detach().to('cpu', copy=True) for k, v in self.nnet.state_dict().items()},
+            'optimizer': copy.deepcopy(self.optimizer.state_dict()) if self.optimizer is not None else None,
+        }
+
+    def restore(self, snapshot):
+        self.nnet.load_state_dict(snapshot['state_dict'])
+        if snapshot.get('optimizer') is not None:
+            if self.optimizer is None:
+                self.optimizer = optim.Adam(self.nnet.parameters(), lr=args.lr)
+            self.optimizer.load_state_dict(snapshot['optimizer'])
+        self.quantize()
+
+    def clone_from(self, other):
+        # load_state_dict copies the tensors, so no intermediate snapshot is needed
+        self.nnet.load_state_dict(other.nnet.state_dict())
+        # the quantized copy is never modified, only replaced, so it can be shared
+        self.qnet = other.qnet
+        self.calibration_boards = other.calibration_boards
+
+    def save_checkpoint(self, folder='checkpoint', filename='checkpoint.pth.tar', writer=None):
+        """
+        If a CheckpointWriter is given, a snapshot of the network is handed to
+        it and written in the background.
+        """
         filepath = os.path.join(folder, filename)
+        if writer is not None:
+            writer.submit(filepath, torch.save, self.snapshot())
+            return
         if not os.path.exists(folder):
-            print("Checkpoint Directory does not exist! Making directory {}".format(folder))
+            log.info("Checkpoint Directory does not exist! Making directory {}".format(folder))
             os.mkdir(folder)
-        else:
-            print("Checkpoint Directory exists! ")
         torch.save({
             'state_dict': self.nnet.state_dict(),
         }, filepath)
 
+    def export(self, folder='checkpoint', filename='best.pt', writer=None):
+        """
+        Exports the network predict uses (the quantized copy, if any) for
+        InferenceNNet: as ONNX if filename ends with .onnx, else as TorchScript.
+        If a CheckpointWriter is given, the file is written in the background.
+        """
+        model = copy.deepcopy(self.nnet if self.qnet is None else self.qnet).cpu().eval()
+        example = torch.zeros(1, self.board_x, self.board_y)
+        if filename.endswith('.onnx'):
+            # the TorchScript-based exporter, which only needs onnx; newer PyTorch defaults to the dynamo
+            # exporter, which also needs onnxscript
+            options = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+
+            def write(model, filepath):
+                torch.onnx.export(model, example, filepath, input_names=['boards'], output_names=['pi', 'v'],
+                                  dynamic_axes={'boards': {0: 'batch'}, 'pi': {0: 'batch'}, 'v': {0: 'batch'}},
+                                  **options)
+        else:
+            with torch.no_grad():
+                model = torch.jit.trace(model, example)
+            write = torch.jit.save
+        filepath = os.path.join(folder, filename)
+        if writer is not None:
+            writer.submit(filepath, write, model)
+            return
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        write(model, filepath)
+
     def load_checkpoint(self, folder='checkpoint', filename='checkpoint.pth.tar'):
         # https://github.com/pytorch/examples/blob/master/imagenet/main.py#L98
         filepath = os.path.join(folder, filename)
@@ -117,4 +426,5 @@ class NNetWrapper(NeuralNet):
             raise ("No model in path {}".format(filepath))
         map_location = None if args.cuda else 'cpu'
         checkpoint = torch.load(filepath, map_location=map_location)
-        self.nnet.load_state_dict(checkpoint['state_dict'])
+        # checkpoints written through a CheckpointWriter also hold the optimizer state
+        self.restore(checkpoint)
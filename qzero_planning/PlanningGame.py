@@ -30,6 +30,22 @@ class PlanningGame(Game):
         c.current_domainaction = self.current_domainaction
         return c
 
+    def getGameForBoard(self, board):
+        """
+        Returns a copy of this game positioned at board, which must be
+        reachable from the initial board by placing the domain actions in
+        order. Used to search again from boards stored in the replay buffer.
+        """
+        c = self.get_copy()
+        board = np.asarray(board)
+        # actions index cells machine-first, see PlanningRepresentation._move_to_action
+        c.legal_actions = [a for a in range(self.machines * self.timesteps)
+                           if board[a % self.machines, a // self.machines] == 0]
+        occupied = np.count_nonzero(board)
+        placed = np.cumsum([0] + [d.duration for d in self.domainactions])
+        c.current_domainaction = int(np.searchsorted(placed, occupied))
+        return c
+
     def getInitBoard(self):
         """
         Returns:
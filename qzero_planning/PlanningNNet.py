@@ -43,7 +43,7 @@ class PlanningNNet(nn.Module):
         s = F.relu(self.bn2(self.conv2(s)))                          # batch_size x num_channels x board_x x board_y
         s = F.relu(self.bn3(self.conv3(s)))                          # batch_size x num_channels x (board_x-2) x (board_y-2)
         s = F.relu(self.bn4(self.conv4(s)))                          # batch_size x num_channels x (board_x-4) x (board_y-4)
-        s = s.view(-1, self.args.num_channels*(self.board_x-4)*(self.board_y-4))
+        s = s.reshape(-1, self.args.num_channels*(self.board_x-4)*(self.board_y-4))
 
         s = F.dropout(F.relu(self.fc_bn1(self.fc1(s))), p=self.args.dropout, training=self.training)  # batch_size x 1024
         s = F.dropout(F.relu(self.fc_bn2(self.fc2(s))), p=self.args.dropout, training=self.training)  # batch_size x 512
@@ -52,3 +52,119 @@ class PlanningNNet(nn.Module):
         v = self.fc4(s)                                                                          # batch_size x 1
 
         return F.log_softmax(pi, dim=1), torch.tanh(v)
+
+
+class ResidualBlock(nn.Module):
+    def __init__(self, channels):
+        super(ResidualBlock, self).__init__()
+        self.conv1 = nn.Conv2d(channels, channels, 3, stride=1, padding=1, bias=False)
+        self.bn1 = nn.BatchNorm2d(channels)
+        self.conv2 = nn.Conv2d(channels, channels, 3, stride=1, padding=1, bias=False)
+        self.bn2 = nn.BatchNorm2d(channels)
+
+    def forward(self, s):
+        out = F.relu(self.bn1(self.conv1(s)))
+        out = self.bn2(self.conv2(out))
+        return F.relu(out + s)
+
+
+class ResPlanningNNet(nn.Module):
+    """
+    AlphaZero-style residual tower of args.num_blocks blocks with
+    args.num_channels channels. The convolutions keep the board size and the
+    value head pools globally over the board, so boards of any size work and
+    the number of parameters hardly grows with the board: only the policy
+    head has a linear layer over the cells, from 2 channels.
+    """
+
+    def __init__(self, game, args):
+        # game params
+        self.board_x, self.board_y = game.getBoardSize()
+        self.action_size = game.getActionSize()
+        self.args = args
+
+        super(ResPlanningNNet, self).__init__()
+        self.conv = nn.Conv2d(1, args.num_channels, 3, stride=1, padding=1, bias=False)
+        self.bn = nn.BatchNorm2d(args.num_channels)
+        self.blocks = nn.Sequential(*[ResidualBlock(args.num_channels) for _ in range(args.num_blocks)])
+
+        self.pi_conv = nn.Conv2d(args.num_channels, 2, 1, bias=False)
+        self.pi_bn = nn.BatchNorm2d(2)
+        self.pi_fc = nn.Linear(2*self.board_x*self.board_y, self.action_size)
+
+        self.v_fc1 = nn.Linear(args.num_channels, args.num_channels)
+        self.v_fc2 = nn.Linear(args.num_channels, 1)
+
+    def forward(self, s):
+        #                                                           s: batch_size x board_x x board_y
+        s = s.view(-1, 1, self.board_x, self.board_y)                # batch_size x 1 x board_x x board_y
+        s = F.relu(self.bn(self.conv(s)))                            # batch_size x num_channels x board_x x board_y
+        s = self.blocks(s)                                           # batch_size x num_channels x board_x x board_y
+
+        pi = F.relu(self.pi_bn(self.pi_conv(s)))                     # batch_size x 2 x board_x x board_y
+        pi = self.pi_fc(pi.reshape(-1, 2*self.board_x*self.board_y))  # batch_size x action_size
+
+        v = s.mean(dim=(2, 3))                                       # batch_size x num_channels
+        v = self.v_fc2(F.relu(self.v_fc1(v)))                        # batch_size x 1
+
+        return F.log_softmax(pi, dim=1), torch.tanh(v)
+
+
+class FCNPlanningNNet(nn.Module):
+    """
+    Fully-convolutional residual tower: the policy is a logit per cell, from
+    a 1x1 convolution, plus a pass logit, and the value head pools globally.
+    No parameter depends on the board size, so one trained network runs on
+    PlanningGames with any number of machines and timesteps: its state dict
+    loads into the network of any game size.
+    """
+
+    def __init__(self, game, args):
+        # game params
+        self.board_x, self.board_y = game.getBoardSize()
+        self.action_size = game.getActionSize()
+        self.args = args
+
+        super(FCNPlanningNNet, self).__init__()
+        self.conv = nn.Conv2d(1, args.num_channels, 3, stride=1, padding=1, bias=False)
+        self.bn = nn.BatchNorm2d(args.num_channels)
+        self.blocks = nn.Sequential(*[ResidualBlock(args.num_channels) for _ in range(args.num_blocks)])
+
+        self.pi_conv = nn.Conv2d(args.num_channels, 1, 1)
+        self.pi_pass = nn.Linear(args.num_channels, 1)
+
+        self.v_fc1 = nn.Linear(args.num_channels, args.num_channels)
+        self.v_fc2 = nn.Linear(args.num_channels, 1)
+
+    def forward(self, s):
+        #                                                           s: batch_size x board_x x board_y
+        s = s.unsqueeze(1)                                           # batch_size x 1 x board_x x board_y
+        s = F.relu(self.bn(self.conv(s)))                            # batch_size x num_channels x board_x x board_y
+        s = self.blocks(s)                                           # batch_size x num_channels x board_x x board_y
+        pooled = s.mean(dim=(2, 3))                                  # batch_size x num_channels
+
+        # actions index cells machine-first (action = machine + machines * timestep), so the
+        # cell logits are flattened timestep-major
+        cells = self.pi_conv(s).transpose(2, 3).flatten(1)           # batch_size x (board_x * board_y)
+        pi = torch.cat([cells, self.pi_pass(pooled)], dim=1)         # batch_size x action_size
+
+        v = self.v_fc2(F.relu(self.v_fc1(pooled)))                   # batch_size x 1
+
+        return F.log_softmax(pi, dim=1), torch.tanh(v)
+
+
+# values of args.architecture
+ARCHITECTURES = {
+    'conv': PlanningNNet,
+    'resnet': ResPlanningNNet,
+    'fcn': FCNPlanningNNet,
+}
+
+
+def build_nnet(game, args):
+    """
+    Returns the network of args.architecture for the game.
+    """
+    if args.architecture not in ARCHITECTURES:
+        raise ValueError(f'Unknown architecture {args.architecture}, expected one of {", ".join(ARCHITECTURES)}')
+    return ARCHITECTURES[args.architecture](game, args)
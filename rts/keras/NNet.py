@@ -72,6 +72,17 @@ class NNetWrapper(NeuralNet):
         pi, v = self.nnet.model.predict(board, verbose=False)
         return pi[0], v[0]
 
+    def predict_batch(self, boards):
+        """
+        Predicts actions for many boards with one forward pass.
+        :param boards: list of boards
+        :return: stacked predicted action vectors and win predictions (Pi, V)
+        """
+        boards = self.encoder.encode_multiple(np.asarray(boards))
+
+        pis, vs = self.nnet.model.predict_on_batch(boards)
+        return np.asarray(pis), np.asarray(vs).reshape(-1)
+
     def save_checkpoint(self, folder='checkpoint', filename='checkpoint.pth.tar'):
         # change extension
         filename = filename.split(".")[0] + ".h5"
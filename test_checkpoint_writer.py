@@ -0,0 +1,112 @@
+import os
+import tempfile
+import unittest
+
+from CheckpointWriter import CheckpointWriter
+
+
+def write_text(text, path):
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def read_text(path):
+    with open(path) as f:
+        return f.read()
+
+
+class TestCheckpointWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.folder = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_writes_through_temporary_file(self):
+        paths = []
+
+        def write(snapshot, path):
+            paths.append(path)
+            write_text(snapshot, path)
+
+        writer = CheckpointWriter(background=True)
+        filepath = os.path.join(self.folder, 'sub', 'best.pth.tar')
+        writer.submit(filepath, write, 'weights')
+        writer.wait()
+        writer.close()
+        self.assertEqual(paths, [filepath + '.tmp'])
+        self.assertEqual(read_text(filepath), 'weights')
+        self.assertEqual(os.listdir(os.path.dirname(filepath)), ['best.pth.tar'])
+        self.assertEqual([f for f, _ in writer.popLatencies()], [filepath])
+
+    def test_failed_write_keeps_previous_file(self):
+        def fail(snapshot, path):
+            write_text('trunc', path)
+            raise IOError('disk full')
+
+        writer = CheckpointWriter(background=False)
+        filepath = os.path.join(self.folder, 'best.pth.tar')
+        writer.submit(filepath, write_text, 'old')
+        with self.assertRaises(IOError):
+            writer.submit(filepath, fail, 'new')
+        self.assertEqual(read_text(filepath), 'old')
+        self.assertEqual(os.listdir(self.folder), ['best.pth.tar'])
+
+    def test_keep_last_per_kind(self):
+        writer = CheckpointWriter(background=False, keep_last=2)
+        for i in range(1, 5):
+            writer.submit(os.path.join(self.folder, f'checkpoint_{i}.pth.tar'), write_text, 'model')
+            writer.submit(os.path.join(self.folder, f'checkpoint_{i}.pth.tar.examples'), write_text, 'examples')
+        writer.submit(os.path.join(self.folder, 'best.pth.tar'), write_text, 'model')
+        self.assertEqual(sorted(os.listdir(self.folder)), [
+            'best.pth.tar',
+            'checkpoint_3.pth.tar', 'checkpoint_3.pth.tar.examples',
+            'checkpoint_4.pth.tar', 'checkpoint_4.pth.tar.examples',
+        ])
+
+    def test_keep_last_orders_numerically(self):
+        writer = CheckpointWriter(background=False, keep_last=1)
+        for i in (9, 10):
+            writer.submit(os.path.join(self.folder, f'checkpoint_{i}.pth.tar'), write_text, 'model')
+        self.assertEqual(os.listdir(self.folder), ['checkpoint_10.pth.tar'])
+
+    def test_background_error_raised_by_wait(self):
+        def fail(snapshot, path):
+            raise ValueError('cannot serialize')
+
+        writer = CheckpointWriter(background=True)
+        writer.submit(os.path.join(self.folder, 'a.pth.tar'), fail, None)
+        with self.assertRaises(ValueError):
+            writer.wait()
+        # the error is reported once, the writer keeps working
+        writer.submit(os.path.join(self.folder, 'b.pth.tar'), write_text, 'ok')
+        writer.wait()
+        writer.close()
+        self.assertEqual(read_text(os.path.join(self.folder, 'b.pth.tar')), 'ok')
+
+    def test_close_stops_thread(self):
+        writer = CheckpointWriter(background=True)
+        writer.submit(os.path.join(self.folder, 'a.pth.tar'), write_text, 'a')
+        writer.close()
+        self.assertFalse(writer.thread.is_alive())
+        self.assertEqual(read_text(os.path.join(self.folder, 'a.pth.tar')), 'a')
+        # later checkpoints are written right away
+        writer.submit(os.path.join(self.folder, 'b.pth.tar'), write_text, 'b')
+        self.assertEqual(read_text(os.path.join(self.folder, 'b.pth.tar')), 'b')
+
+    def test_background_error_raised_by_next_submit(self):
+        def fail(snapshot, path):
+            raise ValueError('cannot serialize')
+
+        writer = CheckpointWriter(background=True)
+        writer.submit(os.path.join(self.folder, 'a.pth.tar'), fail, None)
+        writer.queue.join()
+        with self.assertRaises(ValueError):
+            writer.submit(os.path.join(self.folder, 'b.pth.tar'), write_text, 'ok')
+        writer.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+import os
+import pickle
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import torch
+
+import main
+from Coach import Coach
+from qzero_planning.NNet import NNetWrapper, args as nnet_args
+from qzero_planning.PlanningGame import PlanningGame
+from qzero_planning.PlanningLogic import DomainAction, RelativeProductRewardStrategy
+from utils import dotdict
+
+
+def make_game():
+    domainactions = [DomainAction(urn=1, duration=2), DomainAction(urn=2, duration=1), DomainAction(urn=3, duration=1)]
+    return PlanningGame(machines=5, timesteps=5, domainactions=domainactions,
+                        rewardstrategy=RelativeProductRewardStrategy(-(5 ** 5 + 1)))
+
+
+def make_examples(game, n, reward):
+    board_shape, action_size = game.getBoardSize(), game.getActionSize()
+    return [(np.full(board_shape, i % 3), np.full(action_size, 1. / action_size), reward) for i in range(n)]
+
+
+class CoachTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.args = dotdict(main.args, checkpoint=self.tmp.name + '/', asyncCheckpoints=False, metricsFile=None,
+                            numIters=2, numEps=1, numMCTSSims=2, arenaCompare=2, maxlenOfQueue=100)
+        patcher = mock.patch.dict(nnet_args, num_channels=8, epochs=1, batch_size=8, cuda=False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.game = make_game()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def make_coach(self):
+        return Coach(self.game, NNetWrapper(self.game), self.args)
+
+
+class TestPrepareTrainExamples(CoachTestCase):
+
+    def test_rank_priorities_share_ties(self):
+        self.args.replayPriorities = 'rank'
+        coach = self.make_coach()
+        coach.rankedReward.startIteration(1)
+        rewards = [-3.] * 20 + [-5.] * 20 + [-1.] * 5
+        coach.rankedReward.updateMany(rewards)
+        coach.replayBuffer.add(make_examples(self.game, 20, -3.) + make_examples(self.game, 20, -5.)
+                               + make_examples(self.game, 5, -1.), 1)
+        examples, _ = coach.prepareTrainExamples()
+        rewards = coach.replayBuffer.rewards[examples.index]
+        priorities = examples.take_priorities(np.arange(len(examples)))
+        # 5 examples rank first, the next 20 share rank 6 and the last 20 rank 26
+        for reward, priority in [(-1., 1.), (-3., 1. / 6), (-5., 1. / 26)]:
+            np.testing.assert_allclose(priorities[rewards == reward], priority)
+
+    def test_loss_priorities_written_back(self):
+        self.args.replayPriorities = 'loss'
+        coach = self.make_coach()
+        coach.rankedReward.startIteration(1)
+        coach.rankedReward.updateMany([-3.] * 40)
+        coach.replayBuffer.add(make_examples(self.game, 40, -3.), 1)
+        examples, _ = coach.prepareTrainExamples()
+        # no prioritized_replay arg of the network is needed
+        self.assertIsNone(nnet_args.prioritized_replay)
+        coach.nnet.train(examples)
+        self.assertTrue(np.any(coach.replayBuffer.column(coach.replayBuffer.priorities) != 1.))
+
+
+class TestRunState(CoachTestCase):
+
+    def run_first_iteration(self):
+        """
+        The bookkeeping of learn's first iteration up to the end of self-play,
+        plus a training step so that the optimizer has a state.
+        """
+        coach = self.make_coach()
+        coach.rankedReward.startIteration(1)
+        examples = make_examples(self.game, 20, -3.) + make_examples(self.game, 20, -5.)
+        coach.rankedReward.updateMany([-3.] * 20 + [-5.] * 20)
+        coach.replayBuffer.add(examples, 1)
+        coach.nnet.train(examples)
+        coach.saveTrainExamples(0)
+        coach.saveRunState(1, selfPlayDone=True)
+        return coach
+
+    def assert_same_state(self, coach, resumed):
+        np.testing.assert_array_equal(resumed.replayBuffer.column(resumed.replayBuffer.boards),
+                                      coach.replayBuffer.column(coach.replayBuffer.boards))
+        np.testing.assert_array_equal(resumed.replayBuffer.column(resumed.replayBuffer.rewards),
+                                      coach.replayBuffer.column(coach.replayBuffer.rewards))
+        self.assertEqual(resumed.rankedReward.percentile(), coach.rankedReward.percentile())
+        for name, tensor in coach.nnet.nnet.state_dict().items():
+            self.assertTrue(torch.equal(resumed.nnet.nnet.state_dict()[name], tensor), name)
+        saved, restored = coach.nnet.optimizer.state_dict(), resumed.nnet.optimizer.state_dict()
+        self.assertEqual(saved['param_groups'], restored['param_groups'])
+        for param, state in saved['state'].items():
+            self.assertTrue(torch.equal(restored['state'][param]['exp_avg'], state['exp_avg']))
+            self.assertTrue(torch.equal(restored['state'][param]['exp_avg_sq'], state['exp_avg_sq']))
+
+    def test_resume_after_self_play(self):
+        coach = self.run_first_iteration()
+        expected = np.random.get_state()[1].copy()
+        np.random.rand(10)  # the resumed run must not see these draws
+
+        resumed = self.make_coach()
+        self.assertTrue(resumed.loadRunState())
+        self.assertEqual(resumed.startIter, 1)
+        self.assertTrue(resumed.skipFirstSelfPlay)
+        np.testing.assert_array_equal(np.random.get_state()[1], expected)
+        self.assert_same_state(coach, resumed)
+
+    def test_saved_model_referenced(self):
+        coach = self.run_first_iteration()
+        with open(os.path.join(self.args.checkpoint, coach.getRunStateFile()), 'rb') as f:
+            self.assertIsNotNone(pickle.load(f)['model'])
+
+        # once accepted, the model is saved as the best one and only referenced by the run state
+        coach.nnet.save_checkpoint(folder=self.args.checkpoint, filename='best.pth.tar',
+                                   writer=coach.checkpointWriter)
+        coach.modelFile = 'best.pth.tar'
+        coach.saveRunState(1, selfPlayDone=True)
+        with open(os.path.join(self.args.checkpoint, coach.getRunStateFile()), 'rb') as f:
+            state = pickle.load(f)
+        self.assertIsNone(state['model'])
+        self.assertEqual(state['modelFile'], 'best.pth.tar')
+
+        resumed = self.make_coach()
+        self.assertTrue(resumed.loadRunState())
+        self.assertEqual(resumed.modelFile, 'best.pth.tar')
+        self.assert_same_state(coach, resumed)
+
+    def test_resumed_run_skips_self_play(self):
+        self.run_first_iteration()
+        resumed = self.make_coach()
+        resumed.loadRunState()
+        resumed.args = dotdict(self.args, numIters=1)
+        with mock.patch.object(resumed, 'executeEpisode', side_effect=AssertionError('self-play was repeated')):
+            resumed.learn()
+        self.assertEqual(resumed.replayBuffer.numIterations(), 1)
+        self.assertEqual(len(resumed.replayBuffer), 40)
+
+        # the finished iteration resumes at the next one, with self-play
+        again = self.make_coach()
+        again.loadRunState()
+        self.assertEqual(again.startIter, 2)
+        self.assertFalse(again.skipFirstSelfPlay)
+
+    def test_no_run_state(self):
+        coach = self.make_coach()
+        self.assertFalse(coach.loadRunState())
+        self.assertEqual(coach.startIter, 1)
+        self.assertFalse(os.path.exists(os.path.join(self.args.checkpoint, coach.getRunStateFile())))
+
+
+if __name__ == '__main__':
+    unittest.main()
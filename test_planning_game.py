@@ -0,0 +1,57 @@
+import unittest
+
+import numpy as np
+
+from qzero_planning.PlanningGame import PlanningGame
+from qzero_planning.PlanningLogic import DomainAction, MinSpanTimeRewardStrategy
+
+
+def make_game():
+    domainactions = [DomainAction(urn=3, duration=2), DomainAction(urn=1, duration=1),
+                     DomainAction(urn=200, duration=3), DomainAction(urn=7, duration=1),
+                     DomainAction(urn=2, duration=2)]
+    return PlanningGame(machines=3, timesteps=6, domainactions=domainactions,
+                        rewardstrategy=MinSpanTimeRewardStrategy(-(3 * 6 + 1)))
+
+
+def random_episode(game, rng):
+    """
+    Plays random valid actions from the initial board until the game ends or
+    only passing is left.
+
+    Returns:
+        a list of (game, board) before every action, the game being a copy
+    """
+    game = game.get_copy()
+    board = game.getInitBoard()
+    steps = []
+    while game.getGameEnded(board) is None:
+        valids = game.getValidMoves(board)
+        if valids[-1]:
+            break
+        steps.append((game.get_copy(), board))
+        board = game.getNextState(board, rng.choice(np.flatnonzero(valids)))
+    return steps
+
+
+class TestGetGameForBoard(unittest.TestCase):
+
+    def test_matches_played_games(self):
+        game = make_game()
+        rng = np.random.RandomState(0)
+        for _ in range(50):
+            for played, board in random_episode(game, rng):
+                rebuilt = game.getGameForBoard(board)
+                self.assertEqual(rebuilt.current_domainaction, played.current_domainaction)
+                self.assertEqual(sorted(rebuilt.legal_actions), sorted(played.legal_actions))
+                np.testing.assert_array_equal(rebuilt.getValidMoves(board), played.getValidMoves(board))
+
+    def test_initial_board(self):
+        game = make_game()
+        rebuilt = game.getGameForBoard(game.getInitBoard())
+        self.assertEqual(rebuilt.current_domainaction, 0)
+        self.assertEqual(rebuilt.legal_actions, list(range(3 * 6)))
+
+
+if __name__ == '__main__':
+    unittest.main()
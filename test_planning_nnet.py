@@ -0,0 +1,62 @@
+import unittest
+
+import numpy as np
+import torch
+
+from qzero_planning.PlanningGame import PlanningGame
+from qzero_planning.PlanningLogic import DomainAction, MinSpanTimeRewardStrategy
+from qzero_planning.PlanningNNet import FCNPlanningNNet
+from utils import dotdict
+
+
+def make_game(machines, timesteps):
+    return PlanningGame(machines=machines, timesteps=timesteps, domainactions=[DomainAction(urn=1, duration=1)],
+                        rewardstrategy=MinSpanTimeRewardStrategy(-(machines * timesteps + 1)))
+
+
+class TestFCNPlanningNNet(unittest.TestCase):
+
+    args = dotdict({'num_channels': 4, 'num_blocks': 0})
+
+    def marked_cell_net(self, game):
+        """
+        A network whose policy logit is 1 on the occupied cells of the board
+        and 0 elsewhere (and for pass).
+        """
+        net = FCNPlanningNNet(game, self.args).eval()
+        with torch.no_grad():
+            for parameter in net.parameters():
+                parameter.zero_()
+            net.bn.weight.fill_(1.)
+            net.conv.weight[0, 0, 1, 1] = 1.
+            net.pi_conv.weight[0, 0] = 1.
+        return net
+
+    def test_policy_follows_action_encoding(self):
+        game = make_game(4, 7)
+        net = self.marked_cell_net(game)
+        representation = game._make_representation()
+        for machine, timestep in [(0, 0), (3, 0), (1, 2), (0, 6), (3, 6)]:
+            board = torch.zeros(1, 4, 7)
+            board[0, machine, timestep] = 1.
+            with torch.no_grad():
+                log_pi, _ = net(board)
+            self.assertEqual(log_pi.shape, (1, game.getActionSize()))
+            self.assertEqual(int(log_pi.argmax()), representation._move_to_action((machine, timestep)))
+
+    def test_state_dict_loads_across_sizes(self):
+        small, large = make_game(4, 7), make_game(6, 5)
+        trained = FCNPlanningNNet(small, dotdict(self.args, num_blocks=2)).eval()
+        other = FCNPlanningNNet(large, dotdict(self.args, num_blocks=2)).eval()
+        other.load_state_dict(trained.state_dict())
+        for name, tensor in trained.state_dict().items():
+            self.assertTrue(torch.equal(other.state_dict()[name], tensor), name)
+
+        with torch.no_grad():
+            log_pi, v = other(torch.from_numpy(np.zeros((3, 6, 5), dtype=np.float32)))
+        self.assertEqual(log_pi.shape, (3, large.getActionSize()))
+        self.assertEqual(v.shape, (3, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
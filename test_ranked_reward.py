@@ -0,0 +1,36 @@
+import unittest
+
+import numpy as np
+
+from RankedReward import SlidingPercentile
+
+
+class TestSlidingPercentile(unittest.TestCase):
+
+    def test_matches_np_percentile(self):
+        rewards = np.random.RandomState(0).randint(-20, 0, size=500).astype(float)
+        estimator = SlidingPercentile(75)
+        estimator.startIteration(1)
+        for r in rewards:
+            estimator.update(r)
+        self.assertAlmostEqual(estimator.percentile(), np.percentile(rewards, 75))
+
+    def test_weights_and_window(self):
+        estimator = SlidingPercentile(50, window=2)
+        for iteration, rewards in enumerate([[-100.], [-3., -1.], [-2., -4.]], 1):
+            estimator.startIteration(iteration)
+            for r in rewards:
+                estimator.update(r, weight=3)
+        expected = np.percentile(np.repeat([-3., -1., -2., -4.], 3), 50)
+        self.assertAlmostEqual(estimator.percentile(), expected)
+
+    def test_compression_is_approximate(self):
+        rewards = np.random.RandomState(1).normal(size=5000)
+        estimator = SlidingPercentile(75, max_centroids=64)
+        estimator.startIteration(1)
+        estimator.updateMany(rewards)
+        self.assertAlmostEqual(estimator.percentile(), np.percentile(rewards, 75), delta=0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+
+import numpy as np
+
+import main
+from Reanalyse import Reanalyser
+from ReplayBuffer import ReplayBuffer
+from test_planning_game import make_game, random_episode
+from utils import dotdict
+
+
+class UniformNNet():
+    """
+    Network predicting a uniform policy and a zero value for every board.
+    """
+
+    def __init__(self, game):
+        self.action_size = game.getActionSize()
+
+    def predict(self, board):
+        return np.full(self.action_size, 1. / self.action_size), np.zeros(1)
+
+
+class TestReanalyser(unittest.TestCase):
+
+    def test_rewrites_only_older_iterations(self):
+        game = make_game()
+        rng = np.random.RandomState(0)
+        buffer = ReplayBuffer(100, game.getBoardSize(), game.getActionSize(), board_dtype=np.uint8)
+        for iteration in (1, 2, 3):
+            boards = [board for _ in range(3) for _, board in random_episode(game, rng)]
+            # zero policies, which no search returns
+            buffer.add([(board, np.zeros(game.getActionSize()), -1.) for board in boards], iteration)
+
+        args = dotdict(main.args, numMCTSSims=4, reanalyseSims=None, reanalyseFraction=1.0)
+        reanalyser = Reanalyser(game, UniformNNet(game), buffer, args)
+        reanalyser.start()
+        reanalysed = reanalyser.join()
+
+        (_, first), (_, second), (_, last) = buffer.iterationRows()
+        self.assertEqual(reanalysed, len(first) + len(second))
+        for rows in (first, second):
+            np.testing.assert_allclose(buffer.pis[rows].sum(axis=1), 1., rtol=1e-6)
+            for row in rows:
+                # the refreshed policies only play valid moves from their board
+                valids = game.getGameForBoard(buffer.boards[row]).getValidMoves(buffer.boards[row].astype(int))
+                self.assertEqual(buffer.pis[row][valids == 0].sum(), 0.)
+        np.testing.assert_array_equal(buffer.pis[last], 0.)
+
+    def test_fraction(self):
+        game = make_game()
+        buffer = ReplayBuffer(100, game.getBoardSize(), game.getActionSize(), board_dtype=np.uint8)
+        for iteration in (1, 2):
+            buffer.add([(game.getInitBoard(), np.zeros(game.getActionSize()), -1.)] * 10, iteration)
+        reanalyser = Reanalyser(game, UniformNNet(game), buffer, dotdict(main.args, reanalyseFraction=0.5))
+        reanalyser.rng = np.random.RandomState(0)
+        rows = reanalyser.sampleRows()
+        self.assertEqual(len(rows), 5)
+        self.assertTrue(set(rows) <= set(buffer.iterationRows()[0][1]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from PrioritizedReplay import SumTree
+from ReplayBuffer import ExampleArrays, MemmapReplayBuffer, ReplayBuffer
+
+
+def make_examples(n, reward, board_shape=(3, 3), action_size=10):
+    return [(np.full(board_shape, i % 5), np.full(action_size, 1. / action_size), reward) for i in range(n)]
+
+
+class TestReplayBuffer(unittest.TestCase):
+
+    def test_add_and_evict_iterations(self):
+        buffer = ReplayBuffer(100, (3, 3), 10)
+        for i in range(1, 5):
+            buffer.add(make_examples(10, float(i)), i)
+        self.assertEqual(len(buffer), 40)
+
+        buffer.evict(2)
+        self.assertEqual(buffer.numIterations(), 2)
+        self.assertEqual(len(buffer), 20)
+        self.assertEqual(set(buffer.column(buffer.rewards)), {3., 4.})
+        self.assertTrue(np.all(buffer.rewards[buffer.lastIterationRows()] == 4.))
+
+    def test_ring_overwrites_oldest(self):
+        buffer = ReplayBuffer(25, (3, 3), 10)
+        for i in range(1, 4):
+            buffer.add(make_examples(10, float(i)), i)
+        self.assertEqual(len(buffer), 25)
+        self.assertEqual(list(buffer.segments), [[1, 5], [2, 10], [3, 10]])
+        rewards = buffer.column(buffer.rewards)
+        self.assertEqual(list(rewards), [1.] * 5 + [2.] * 10 + [3.] * 10)
+
+    def test_inputs_computed_on_add(self):
+        buffer = ReplayBuffer(25, (3, 3), 10, input_fn=lambda boards: (boards != 0).astype(np.int8))
+        buffer.add(make_examples(10, 1.), 1)
+        np.testing.assert_array_equal(buffer.column(buffer.inputs), buffer.column(buffer.boards) != 0)
+
+    def test_board_dtype(self):
+        boards = np.array([[[256, 130], [0, 1]]])
+        buffer = ReplayBuffer(10, (2, 2), 4, board_dtype=np.uint16)
+        buffer.addArrays(boards, np.zeros((1, 4)), np.zeros(1), 1)
+        np.testing.assert_array_equal(buffer.column(buffer.boards), boards)
+        # values that do not fit are rejected rather than wrapped around
+        with self.assertRaises(ValueError):
+            ReplayBuffer(10, (2, 2), 4).addArrays(boards, np.zeros((1, 4)), np.zeros(1), 1)
+
+    def test_save_and_load(self):
+        buffer = ReplayBuffer(25, (3, 3), 10, pi_dtype=np.float16)
+        for i in range(1, 4):
+            buffer.add(make_examples(10, float(i)), i)
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'checkpoint_3.pth.tar.examples')
+            buffer.save(filename)
+            loaded = ReplayBuffer(25, (3, 3), 10, pi_dtype=np.float16)
+            loaded.load(filename)
+        self.assertEqual(list(loaded.segments), list(buffer.segments))
+        np.testing.assert_array_equal(loaded.column(loaded.boards), buffer.column(buffer.boards))
+        np.testing.assert_array_equal(loaded.column(loaded.pis), buffer.column(buffer.pis))
+
+    def test_priorities_kept(self):
+        buffer = ReplayBuffer(25, (3, 3), 10)
+        buffer.add(make_examples(10, 1.), 1)
+        rows = buffer.indices()
+        examples = ExampleArrays(buffer.inputs, buffer.pis, buffer.values, index=rows[::-1],
+                                 priorities=buffer.priorities)
+        examples.put_priorities(np.array([0, 1]), np.array([5., 3.]))
+        self.assertEqual(list(buffer.priorities[rows[-2:]]), [3., 5.])
+        self.assertEqual(list(examples.subset(np.array([1])).take_priorities(np.array([0]))), [3.])
+
+        # new examples start with the highest priority
+        buffer.add(make_examples(5, 2.), 2)
+        np.testing.assert_array_equal(buffer.priorities[buffer.lastIterationRows()], 5.)
+        with tempfile.TemporaryDirectory() as folder:
+            filename = os.path.join(folder, 'checkpoint_2.pth.tar.examples')
+            buffer.save(filename)
+            loaded = ReplayBuffer(25, (3, 3), 10)
+            loaded.load(filename)
+        np.testing.assert_array_equal(loaded.column(loaded.priorities), buffer.column(buffer.priorities))
+
+    def test_memmap_buffer_reopens(self):
+        with tempfile.TemporaryDirectory() as folder:
+            buffer = MemmapReplayBuffer(folder, 25, (3, 3), 10)
+            for i in range(1, 4):
+                buffer.add(make_examples(10, float(i)), i)
+            filename = os.path.join(folder, 'checkpoint_3.pth.tar.examples')
+            buffer.save(filename)
+            # a new buffer on the same folder starts empty, until asked to load
+            reopened = MemmapReplayBuffer(folder, 25, (3, 3), 10)
+            self.assertEqual(len(reopened), 0)
+            reopened.load(filename)
+            self.assertEqual(list(reopened.segments), list(buffer.segments))
+            np.testing.assert_array_equal(reopened.column(reopened.rewards), buffer.column(buffer.rewards))
+            del buffer, reopened
+
+    def test_memmap_rejects_overwritten_manifest(self):
+        with tempfile.TemporaryDirectory() as folder:
+            buffer = MemmapReplayBuffer(folder, 25, (3, 3), 10)
+            buffer.add(make_examples(10, 1.), 1)
+            filename = os.path.join(folder, 'checkpoint_1.pth.tar.examples')
+            buffer.save(filename)
+            for i in range(2, 5):
+                buffer.add(make_examples(10, float(i)), i)
+            buffer.flush()
+            reopened = MemmapReplayBuffer(folder, 25, (3, 3), 10)
+            with self.assertRaises(ValueError):
+                reopened.load(filename)
+            self.assertEqual(len(reopened), 0)
+            del buffer, reopened
+
+    def test_example_arrays_sample(self):
+        examples = ExampleArrays.from_examples(make_examples(7, 1.))
+        ids = examples.sample_ids(4)
+        self.assertTrue(np.all((0 <= ids) & (ids < 7)))
+        boards, pis, vs = examples.take(ids)
+        self.assertEqual(boards.shape, (4, 3, 3))
+        self.assertEqual(pis.shape, (4, 10))
+        self.assertEqual(vs.shape, (4,))
+
+    def test_example_arrays_index(self):
+        boards = np.arange(10).reshape(10, 1)
+        examples = ExampleArrays(boards, np.zeros((10, 2)), np.arange(10.), index=np.array([7, 2]))
+        boards, _, vs = examples.take(np.array([1, 0]))
+        self.assertEqual(list(boards[:, 0]), [2, 7])
+        self.assertEqual(list(vs), [2., 7.])
+
+    def test_example_arrays_subset(self):
+        boards = np.arange(10).reshape(10, 1)
+        examples = ExampleArrays(boards, np.zeros((10, 2)), np.arange(10.), index=np.array([7, 2, 5]),
+                                 weights=np.array([1., 2., 3.]))
+        subset = examples.subset(np.array([2, 0]))
+        self.assertIs(subset.boards, boards)
+        self.assertEqual(len(subset), 2)
+        self.assertEqual(list(subset.take(np.arange(2))[2]), [5., 7.])
+        np.testing.assert_array_equal(subset.weights, [3., 1.])
+
+    def test_example_arrays_dedup(self):
+        boards = np.array([[0, 1], [1, 1], [0, 1], [0, 1]])
+        pis = np.array([[1., 0.], [0., 1.], [0., 1.], [0., 1.]])
+        examples = ExampleArrays(boards, pis, np.array([1., 0., 0., 0.5]))
+        merged = examples.dedup(boards)
+        self.assertEqual(len(merged), 2)
+        np.testing.assert_array_equal(merged.boards, [[0, 1], [1, 1]])
+        np.testing.assert_allclose(merged.pis, [[1. / 3, 2. / 3], [0., 1.]])
+        np.testing.assert_allclose(merged.vs, [0.5, 0.])
+        np.testing.assert_array_equal(merged.weights, [3., 1.])
+
+
+class TestSumTree(unittest.TestCase):
+
+    def test_sample_proportional_to_priority(self):
+        priorities = np.array([1., 0., 3., 4., 2.])
+        tree = SumTree(priorities)
+        self.assertAlmostEqual(tree.total(), 10.)
+        ids = np.concatenate([tree.sample(100) for _ in range(100)])
+        np.testing.assert_allclose(np.bincount(ids, minlength=5) / len(ids), priorities / 10., atol=0.01)
+
+    def test_update(self):
+        tree = SumTree(np.ones(6))
+        tree.update(np.array([0, 5]), np.array([0., 7.]))
+        self.assertAlmostEqual(tree.total(), 11.)
+        self.assertNotIn(0, tree.sample(200))
+
+
+if __name__ == '__main__':
+    unittest.main()
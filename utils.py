@@ -1,3 +1,10 @@
+import logging
+import os
+import random
+
+import numpy as np
+
+
 class AverageMeter(object):
     """From https://github.com/pytorch/examples/blob/master/imagenet/main.py"""
 
@@ -19,4 +26,88 @@ class AverageMeter(object):
 
 class dotdict(dict):
     def __getattr__(self, name):
-        return self[name]
+        try:
+            return self[name]
+        except KeyError:
+            # an AttributeError lets copy, pickle and hasattr probe for attributes
+            raise AttributeError(name)
+
+
+def get_rng_state():
+    """
+    Returns the states of the random number generators of Python, NumPy and
+    (if installed) PyTorch.
+    """
+    state = {'random': random.getstate(), 'numpy': np.random.get_state()}
+    try:
+        import torch
+    except ImportError:
+        return state
+    state['torch'] = torch.get_rng_state()
+    if torch.cuda.is_available():
+        state['torch_cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    """
+    Restores random number generator states returned by get_rng_state.
+    """
+    random.setstate(state['random'])
+    np.random.set_state(state['numpy'])
+    if 'torch' in state:
+        import torch
+        torch.set_rng_state(state['torch'])
+        if 'torch_cuda' in state and torch.cuda.is_available():
+            torch.cuda.set_rng_state_all(state['torch_cuda'])
+
+
+def set_seed(seed, worker=0):
+    """
+    Seeds the random number generators of Python, NumPy and (if installed)
+    PyTorch, so that runs are reproducible. Every worker (process or thread
+    with its own generators) gets a different seed derived from seed and its
+    index.
+
+    Returns:
+        the seed of the worker
+    """
+    seed = int(np.random.SeedSequence([seed, worker]).generate_state(1)[0])
+    random.seed(seed)
+    np.random.seed(seed)
+    try:
+        import torch
+    except ImportError:
+        return seed
+    torch.manual_seed(seed)
+    if torch.cuda.is_available():
+        torch.backends.cudnn.deterministic = True
+        torch.backends.cudnn.benchmark = False
+    return seed
+
+
+def set_torch_threads(intra_op=None, inter_op=None):
+    """
+    Sets the number of threads PyTorch uses within an operation (intra_op)
+    and to run operations in parallel (inter_op), for the whole process.
+    None leaves a setting unchanged.
+
+    inter_op can only be set before PyTorch runs its first parallel work;
+    later attempts are logged and ignored.
+    """
+    import torch
+    if intra_op and torch.get_num_threads() != intra_op:
+        torch.set_num_threads(intra_op)
+    if inter_op and torch.get_num_interop_threads() != inter_op:
+        try:
+            torch.set_num_interop_threads(inter_op)
+        except RuntimeError as e:
+            logging.getLogger(__name__).warning(f'Could not set {inter_op} inter-op threads: {e}')
+
+
+def set_cpu_affinity(cpus):
+    """
+    Pins the current process (and the threads it starts afterwards) to the
+    given CPU ids, e.g. to give parallel workers disjoint cores.
+    """
+    os.sched_setaffinity(0, cpus)